@@ -1,16 +1,27 @@
+import time
+_IMPORT_STARTED = time.perf_counter()  # cf. PROFIL DE DÉMARRAGE
 import base64
 import json
 import os
 import traceback
-import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
-from datetime import datetime
+import threading
+import hashlib
+import uuid
+import queue
+import tracemalloc
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta, timezone
 import xmlrpc.client
 from urllib.parse import quote
-import pandas as pd 
 import requests
-from google.cloud import firestore, secretmanager
+
+try:
+    import ijson
+except ImportError:
+    ijson = None  # lecture en flux des réponses Silae indisponible
 
 try:
     from cryptography.fernet import Fernet
@@ -22,24 +33,198 @@ except ImportError:
 SMTP_HOST = "mail.infomaniak.com"
 SMTP_PORT = 587
 
+# --- PROFIL DE DÉMARRAGE ---
+def process_uptime():
+    """Secondes depuis le lancement du processus (Linux), None ailleurs."""
+    try:
+        with open("/proc/self/stat") as f:
+            start_ticks = int(f.read().rsplit(")", 1)[1].split()[19])
+        with open("/proc/uptime") as f:
+            return float(f.read().split()[0]) - start_ticks / os.sysconf("SC_CLK_TCK")
+    except Exception:
+        return None
+
+class StartupProfile:
+    """Coût du démarrage à froid : import du module, création des clients GCP, premier appel.
+
+    Le résumé est affiché une seule fois, au premier appel (déclenchement du Robot).
+    """
+
+    def __init__(self, started):
+        self.started = started
+        self.steps = {}
+        self.first_call = None
+        self._lock = threading.Lock()
+
+    def record(self, label, seconds):
+        with self._lock: self.steps[label] = round(seconds * 1000, 1)
+
+    def loaded(self):
+        self.record("import", time.perf_counter() - self.started)
+
+    def called(self):
+        if self.first_call is not None: return
+        with self._lock:
+            if self.first_call is not None: return
+            uptime = process_uptime()
+            self.first_call = {"since_import_ms": round((time.perf_counter() - self.started) * 1000, 1),
+                               "since_process_ms": round(uptime * 1000) if uptime is not None else None}
+        print(f"Démarrage : {self.summary()}")
+
+    def summary(self):
+        with self._lock:
+            parts = [f"{label} {ms:.0f} ms" for label, ms in self.steps.items()]
+            first = self.first_call
+        if first:
+            process = f", {first['since_process_ms']} ms après le lancement du processus" if first['since_process_ms'] is not None else ""
+            parts.append(f"premier appel {first['since_import_ms']:.0f} ms après le début de l'import{process}")
+        return ", ".join(parts)
+
+    def as_dict(self):
+        with self._lock:
+            return {"steps_ms": dict(self.steps), "first_call": self.first_call}
+
+startup_profile = StartupProfile(_IMPORT_STARTED)
+
 # --- Initialisation GCP ---
-try:
+INIT_ERROR = "ERREUR CRITIQUE INIT"
+
+class LazyClient:
+    """Client GCP créé au premier usage plutôt qu'à l'import (démarrage à froid plus court).
+
+    S'utilise comme le client lui-même ; faux (`if not db`) si la création a échoué,
+    échec retenu comme avec l'ancienne initialisation au chargement.
+    """
+
+    def __init__(self, name, factory):
+        self.name = name
+        self._factory = factory
+        self._client = None
+        self._failed = False
+        self._lock = threading.Lock()
+
+    def get(self):
+        if self._client is None and not self._failed:
+            with self._lock:
+                if self._client is None and not self._failed:
+                    started = time.perf_counter()
+                    try:
+                        self._client = self._factory()
+                    except Exception as e:
+                        print(f"{INIT_ERROR} ({self.name}): {e}")
+                        self._failed = True
+                    startup_profile.record(f"client {self.name}", time.perf_counter() - started)
+        return self._client
+
+    def __bool__(self):
+        return self.get() is not None
+
+    def __getattr__(self, attr):
+        client = self.get()
+        if client is None: raise Exception(f"Client {self.name} indisponible")
+        return getattr(client, attr)
+
+def _firestore_client():
+    from google.cloud import firestore
     project_id = os.environ.get("GCP_PROJECT") or os.environ.get("GCLOUD_PROJECT")
-    SECRET_CLIENT = secretmanager.SecretManagerServiceClient()
-    DB = firestore.Client(project=project_id, database="payflow-db") 
-except Exception as e:
-    print(f"ERREUR CRITIQUE INIT: {e}")
-    SECRET_CLIENT = None
-    DB = None
+    # On précise le nom de la base Firestore si nécessaire
+    return firestore.Client(project=project_id, database="payflow-db")
+
+def _secret_client():
+    from google.cloud import secretmanager
+    return secretmanager.SecretManagerServiceClient()
+
+# Ni l'import gRPC ni la recherche des identifiants ne sont payés au chargement du module
+SECRET_CLIENT = LazyClient("secretmanager", _secret_client)
+DB = LazyClient("firestore", _firestore_client)
+
+# --- CACHE SECRETS ---
+SECRET_TTL = int(os.environ.get("PAYFLOW_SECRET_TTL", "600"))
+SECRET_NEGATIVE_TTL = int(os.environ.get("PAYFLOW_SECRET_NEGATIVE_TTL", "60"))
+_MISSING = object()
+
+def is_not_found(error):
+    # google.api_core n'est importé qu'ici : une erreur Secret Manager l'a déjà chargé
+    from google.api_core.exceptions import NotFound
+    return isinstance(error, NotFound)
+
+class SecretCache:
+    """Cache mémoire des secrets Secret Manager.
+
+    Une valeur est servie pendant `ttl` secondes et rechargée en tâche de fond passé
+    `refresh_ratio` * `ttl`. Un secret inexistant est mémorisé `negative_ttl` secondes.
+    """
+
+    def __init__(self, fetch, ttl=SECRET_TTL, negative_ttl=SECRET_NEGATIVE_TTL, refresh_ratio=0.8):
+        self._fetch = fetch
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.refresh_ratio = refresh_ratio
+        self._entries = {}
+        self._refreshing = set()
+        self._lock = threading.Lock()
+
+    def get(self, name):
+        with self._lock:
+            entry = self._entries.get(name)
+        if entry:
+            value, loaded_at = entry
+            age = time.monotonic() - loaded_at
+            if value is _MISSING:
+                if age < self.negative_ttl: raise Exception(f"Secret {name} introuvable")
+            elif age < self.ttl:
+                if age > self.ttl * self.refresh_ratio: self._refresh_async(name)
+                return value
+        return self._load(name)
+
+    def _load(self, name):
+        try:
+            value = self._fetch(name)
+        except Exception as e:
+            if not is_not_found(e): raise
+            with self._lock: self._entries[name] = (_MISSING, time.monotonic())
+            raise Exception(f"Secret {name} introuvable")
+        with self._lock: self._entries[name] = (value, time.monotonic())
+        return value
+
+    def _refresh_async(self, name):
+        with self._lock:
+            if name in self._refreshing: return
+            self._refreshing.add(name)
+
+        def run():
+            try:
+                self._load(name)
+            except Exception as e:
+                # On garde l'ancienne valeur jusqu'à expiration
+                print(f"Rafraîchissement secret {name} échoué: {e}")
+            finally:
+                with self._lock: self._refreshing.discard(name)
+
+        threading.Thread(target=run, daemon=True).start()
+
+    def refresh(self, name=None, min_age=0):
+        """Force le rechargement (rotation de secret). `min_age` évite de relire un secret tout juste chargé."""
+        now = time.monotonic()
+        with self._lock:
+            for k in [k for k, (_, loaded_at) in self._entries.items() if (name is None or k == name) and now - loaded_at >= min_age]:
+                del self._entries[k]
+            _fernets.clear()
 
 # --- Fonctions Utilitaires ---
 
+def fetch_secret(name):
+    project_id = os.environ.get("GCP_PROJECT")
+    path = f"projects/{project_id}/secrets/{name}/versions/latest"
+    response = SECRET_CLIENT.access_secret_version(request={"name": path})
+    return response.payload.data.decode("UTF-8").strip()
+
+secrets_cache = SecretCache(fetch_secret)
+_fernets = {}
+
 def get_secret(name):
     try:
-        project_id = os.environ.get("GCP_PROJECT")
-        path = f"projects/{project_id}/secrets/{name}/versions/latest"
-        response = SECRET_CLIENT.access_secret_version(request={"name": path})
-        return response.payload.data.decode("UTF-8").strip()
+        return secrets_cache.get(name)
     except Exception as e:
         print(f"Erreur lecture secret {name}: {e}")
         return None
@@ -49,10 +234,17 @@ def get_encryption_key():
     if not key_data: raise Exception("Clé de cryptage introuvable")
     return key_data
 
+def get_fernet(key):
+    # L'objet Fernet est réutilisé tant que la clé ne change pas
+    f = _fernets.get(key)
+    if not f:
+        f = _fernets[key] = Fernet(key)
+    return f
+
 def decrypt_data(encrypted_data, key):
     if not encrypted_data: return None
     try:
-        f = Fernet(key)
+        f = get_fernet(key)
         return f.decrypt(encrypted_data.encode()).decode()
     except Exception:
         return encrypted_data
@@ -70,6 +262,11 @@ def send_error_email(recipient_email, client_name, period, error_message):
         return
 
     try:
+        # Modules d'envoi chargés seulement quand une alerte part
+        import smtplib
+        from email.mime.multipart import MIMEMultipart
+        from email.mime.text import MIMEText
+
         subject = f"❌ Échec Import PayFlow : {client_name} ({period})"
         body = f"""
         Bonjour,
@@ -98,24 +295,501 @@ def send_error_email(recipient_email, client_name, period, error_message):
     except Exception as e:
         print(f"❌ Erreur envoi mail : {e}")
 
+# --- MESURES (SPANS) ---
+_trace_local = threading.local()
+
+class Trace:
+    """Durée et nombre d'appels réseau (RPC) par étape d'un import.
+
+    Les spans imbriqués sont permis ; un RPC est compté dans chaque span ouvert.
+    `observer(étape, hôte, secondes, rpc)` est appelé à la fin de chaque span.
+    """
+
+    def __init__(self, host=None, observer=None):
+        self.host = host
+        self.observer = observer
+        self.spans = {}
+        self._stack = []
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def span(self, name):
+        entry = {"rpc": 0}
+        self._stack.append(entry)
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            self._stack = [e for e in self._stack if e is not entry]
+            with self._lock:
+                st = self.spans.setdefault(name, {"ms": 0.0, "calls": 0, "rpc": 0})
+                st["ms"] += elapsed * 1000
+                st["calls"] += 1
+                st["rpc"] += entry["rpc"]
+            if self.observer: self.observer(name, self.host, elapsed, entry["rpc"])
+
+    def count_rpc(self, n=1):
+        for entry in self._stack: entry["rpc"] += n
+
+    def as_dict(self):
+        with self._lock:
+            return {k: {"ms": round(v["ms"], 1), "calls": v["calls"], "rpc": v["rpc"]} for k, v in self.spans.items()}
+
+def current_trace():
+    return getattr(_trace_local, "trace", None)
+
+@contextmanager
+def use_trace(trace):
+    """Rend `trace` courant pour le thread (les spans et RPC du bloc y sont rattachés)."""
+    previous = current_trace()
+    _trace_local.trace = trace
+    try:
+        yield trace
+    finally:
+        _trace_local.trace = previous
+
+@contextmanager
+def span(name):
+    trace = current_trace()
+    if not trace:
+        yield
+        return
+    with trace.span(name):
+        yield
+
+def count_rpc(n=1):
+    trace = current_trace()
+    if trace: trace.count_rpc(n)
+
+def format_timings(trace):
+    return " ".join(f"{k}={v['ms']:.0f}ms/{v['rpc']}rpc" for k, v in trace.as_dict().items())
+
+# --- CONNEXIONS HTTP / XML-RPC ---
+SILAE_STREAMING = os.environ.get("PAYFLOW_SILAE_STREAMING", "0") == "1" and ijson is not None
+TRACE_MEMORY = os.environ.get("PAYFLOW_TRACE_MEMORY", "0") == "1"
+
+HTTP_TIMEOUT = (int(os.environ.get("PAYFLOW_HTTP_CONNECT_TIMEOUT", "10")), int(os.environ.get("PAYFLOW_HTTP_READ_TIMEOUT", "120")))
+HTTP_POOL_SIZE = int(os.environ.get("PAYFLOW_HTTP_POOL_SIZE", "10"))
+ODOO_TIMEOUT = int(os.environ.get("PAYFLOW_ODOO_TIMEOUT", "120"))
+ODOO_POOL_SIZE = int(os.environ.get("PAYFLOW_ODOO_POOL_SIZE", "4"))
+# Points d'accès Silae (surchargés pour les bancs d'essai locaux, cf. benchmarks/)
+SILAE_AUTH_URL = os.environ.get("PAYFLOW_SILAE_AUTH_URL", "https://payroll-api-auth.silae.fr/oauth2/v2.0/token")
+SILAE_API_URL = os.environ.get("PAYFLOW_SILAE_API_URL", "https://payroll-api.silae.fr").rstrip("/")
+
+def build_http_session():
+    """Session requests partagée (keep-alive) pour les appels Silae."""
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+http_session = build_http_session()
+
+def http_post(url, **kwargs):
+    count_rpc()
+    kwargs.setdefault("timeout", HTTP_TIMEOUT)
+    return http_session.post(url, **kwargs)
+
+class KeepAliveTransport(xmlrpc.client.SafeTransport):
+    """Transport XML-RPC HTTPS qui garde sa connexion ouverte d'un appel à l'autre (HTTP/1.1)."""
+
+    def __init__(self, pool, timeout=ODOO_TIMEOUT):
+        super().__init__()
+        self.pool = pool
+        self.timeout = timeout
+
+    def make_connection(self, host):
+        if not (self._connection[1] and self._connection[0] == host):
+            self.pool.record(host, connections=1)
+        conn = super().make_connection(host)
+        conn.timeout = self.timeout
+        return conn
+
+    def request(self, host, handler, request_body, verbose=False):
+        self.pool.record(host, requests=1)
+        return super().request(host, handler, request_body, verbose)
+
+class OdooTransportPool:
+    """Connexions XML-RPC ouvertes, conservées par hôte Odoo (au plus `size` inactives par hôte)."""
+
+    def __init__(self, size=ODOO_POOL_SIZE):
+        self.size = size
+        self._idle = {}
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, host):
+        with self._lock:
+            idle = self._idle.get(host)
+            if idle: return idle.pop()
+        return KeepAliveTransport(self)
+
+    def release(self, host, transport):
+        with self._lock:
+            idle = self._idle.setdefault(host, [])
+            if len(idle) < self.size:
+                idle.append(transport)
+                return
+        transport.close()
+
+    def record(self, host, requests=0, connections=0):
+        with self._lock:
+            st = self._stats.setdefault(host, {"requests": 0, "connections": 0})
+            st["requests"] += requests
+            st["connections"] += connections
+
+    def stats(self):
+        with self._lock:
+            return {h: dict(st, idle=len(self._idle.get(h, []))) for h, st in self._stats.items()}
+
+class PooledTransport(xmlrpc.client.Transport):
+    """Transport donné au ServerProxy : emprunte une connexion du pool le temps d'un appel."""
+
+    def __init__(self, pool):
+        super().__init__()
+        self.pool = pool
+
+    def request(self, host, handler, request_body, verbose=False):
+        count_rpc()
+        transport = self.pool.acquire(host)
+        try:
+            return transport.request(host, handler, request_body, verbose)
+        finally:
+            self.pool.release(host, transport)
+
+odoo_transports = OdooTransportPool()
+
+def odoo_proxy(url):
+    return xmlrpc.client.ServerProxy(url, transport=PooledTransport(odoo_transports))
+
+def connection_stats():
+    """Statistiques de réutilisation des connexions (Silae via requests, Odoo via XML-RPC)."""
+    silae = {"requests": 0, "connections": 0}
+    pools = http_session.get_adapter("https://").poolmanager.pools
+    for key in pools.keys():
+        pool = pools[key]
+        silae["requests"] += pool.num_requests
+        silae["connections"] += pool.num_connections
+    return {"silae": silae, "odoo": odoo_transports.stats()}
+
+# --- SESSIONS ODOO ---
+ODOO_SESSION_MAX = int(os.environ.get("PAYFLOW_ODOO_SESSION_MAX", "256"))
+
+def is_access_denied(fault):
+    # Odoo renvoie faultCode 3 (AccessDenied) quand l'uid/mot de passe n'est plus accepté
+    return fault.faultCode == 3 or "AccessDenied" in str(fault.faultString) or "Access Denied" in str(fault.faultString)
+
+class OdooSession:
+    """Connexion à une base Odoo : l'uid est obtenu une fois puis réutilisé.
+
+    Une nouvelle authentification n'a lieu que si un appel est refusé (AccessDenied).
+    """
+
+    def __init__(self, host, database, login, password):
+        self.host = host
+        self.database = database
+        self.login = login
+        self.password = password
+        self.uid = None
+        self.common = odoo_proxy(f"https://{host}/xmlrpc/2/common")
+        self.models = odoo_proxy(f"https://{host}/xmlrpc/2/object")
+        self._lock = threading.Lock()
+
+    def authenticate(self, force=False):
+        with self._lock:
+            if force or not self.uid:
+                with span("odoo_authenticate"):
+                    self.uid = self.common.authenticate(self.database, self.login, self.password, {}) or None
+            return self.uid
+
+    def execute_kw(self, model, method, args, kw=None):
+        uid = self.authenticate()
+        if not uid: raise Exception("Auth Odoo échouée")
+        try:
+            return self.models.execute_kw(self.database, uid, self.password, model, method, args, kw or {})
+        except xmlrpc.client.Fault as e:
+            if not is_access_denied(e): raise
+            # Session refusée (mot de passe changé, utilisateur réactivé...) : on se réauthentifie une fois
+            uid = self.authenticate(force=True)
+            if not uid: raise
+            return self.models.execute_kw(self.database, uid, self.password, model, method, args, kw or {})
+
+class OdooSessionPool:
+    """Sessions Odoo partagées, par (hôte, base, login, empreinte du mot de passe)."""
+
+    def __init__(self, max_sessions=ODOO_SESSION_MAX):
+        self.max_sessions = max_sessions
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, host, database, login, password):
+        key = (host, database, login, hashlib.sha256((password or "").encode()).hexdigest())
+        with self._lock:
+            session = self._sessions.get(key)
+            if session:
+                self._sessions.move_to_end(key)
+                return session
+            session = self._sessions[key] = OdooSession(host, database, login, password)
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+            return session
+
+    def for_client(self, conf):
+        return self.get(conf.get('odoo_host'), conf.get('database_odoo'), conf.get('odoo_login'), conf.get('odoo_password'))
+
+odoo_sessions = OdooSessionPool()
+
+# --- CACHE PLAN COMPTABLE ODOO ---
+ODOO_CACHE_TTL = int(os.environ.get("PAYFLOW_ODOO_CACHE_TTL", "3600"))
+ODOO_CACHE_MAX_BYTES = int(os.environ.get("PAYFLOW_ODOO_CACHE_MAX_BYTES", str(8 * 1024 * 1024)))
+
+class OdooChartCache:
+    """Cache LRU par base Odoo (host, base, société) : comptes, journaux et style de domaine Odoo 18+.
+
+    Les entrées expirent après `ttl` secondes ; au-delà de `max_bytes` (taille estimée),
+    les entrées les moins récemment utilisées sont évincées.
+    """
+
+    def __init__(self, ttl=ODOO_CACHE_TTL, max_bytes=ODOO_CACHE_MAX_BYTES):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(conf):
+        return (conf.get('odoo_host'), conf.get('database_odoo'), conf.get('odoo_company_id'))
+
+    @staticmethod
+    def _estimate(entry):
+        # Estimation grossière : surcoût d'un item de dict + longueur de la clé
+        return 256 + sum(72 + len(str(k)) for k in entry['accounts']) + sum(72 + len(str(k)) for k in entry['journals'])
+
+    def _drop(self, key):
+        entry = self._entries.pop(key, None)
+        if entry: self._size -= entry['size']
+
+    def get(self, key):
+        """Retourne une copie de l'entrée (comptes, journaux, odoo18) ou une entrée vide."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry['expires'] < time.monotonic():
+                self._drop(key)
+                entry = None
+            if not entry:
+                return {'accounts': {}, 'journals': {}, 'odoo18': None}
+            self._entries.move_to_end(key)
+            return {'accounts': dict(entry['accounts']), 'journals': dict(entry['journals']), 'odoo18': entry['odoo18']}
+
+    def update(self, key, accounts=None, journals=None, odoo18=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if not entry or entry['expires'] < time.monotonic():
+                self._drop(key)
+                entry = {'accounts': {}, 'journals': {}, 'odoo18': None, 'size': 0, 'expires': time.monotonic() + self.ttl}
+            else:
+                self._drop(key)
+            if accounts: entry['accounts'].update(accounts)
+            if journals: entry['journals'].update(journals)
+            if odoo18 is not None: entry['odoo18'] = odoo18
+            entry['size'] = self._estimate(entry)
+            self._entries[key] = entry
+            self._size += entry['size']
+            while self._size > self.max_bytes and len(self._entries) > 1:
+                self._drop(next(iter(self._entries)))
+
+    def invalidate(self, host=None, database=None, company_id=None):
+        """Supprime les entrées correspondant aux critères fournis (aucun critère = tout vider)."""
+        with self._lock:
+            for k in [k for k in self._entries if (host is None or k[0] == host) and (database is None or k[1] == database) and (company_id is None or k[2] == company_id)]:
+                self._drop(k)
+
+odoo_chart_cache = OdooChartCache()
+
 # --- FONCTIONS MÉTIER ---
 
-def get_silae_token(config):
-    auth_url = "https://payroll-api-auth.silae.fr/oauth2/v2.0/token"
+def fetch_silae_token(config):
+    auth_url = SILAE_AUTH_URL
     data = {"grant_type": "client_credentials", "client_id": config['client_id'], "client_secret": config['client_secret'], "scope": "https://silaecloudb2c.onmicrosoft.com/36658aca-9556-41b7-9e48-77e90b006f34/.default"}
-    r = requests.post(auth_url, data=data)
-    r.raise_for_status()
-    return r.json()["access_token"]
+    with span("silae_token"):
+        r = http_post(auth_url, data=data)
+        r.raise_for_status()
+        payload = r.json()
+    return payload["access_token"], payload.get("expires_in", 3600)
 
-def get_silae_ecritures(token, config, dossier, start, end):
-    url = "https://payroll-api.silae.fr/payroll/v1/EcrituresComptables/EcrituresComptables4"
-    headers = {"Authorization": f"Bearer {token}", "Ocp-Apim-Subscription-Key": config['subscription_key'], "Content-Type": "application/json", "dossiers": str(dossier)}
+class SilaeTokenProvider:
+    """Jeton OAuth2 Silae partagé par tout le processus.
+
+    Le jeton est conservé jusqu'à `margin` secondes avant son `expires_in` ; un seul
+    thread le renouvelle à la fois, les autres attendent et réutilisent le résultat.
+    """
+
+    def __init__(self, margin=60):
+        self.margin = margin
+        self._tokens = {}
+        self._lock = threading.Lock()
+
+    def get(self, config):
+        with self._lock:
+            cached = self._tokens.get(config['client_id'])
+            if cached and cached[1] > time.monotonic():
+                return cached[0]
+            token, expires_in = fetch_silae_token(config)
+            self._tokens[config['client_id']] = (token, time.monotonic() + max(int(expires_in) - self.margin, 0))
+            return token
+
+    def invalidate(self, token=None):
+        """Oublie le jeton (refusé par Silae). Avec `token`, seul ce jeton précis est oublié."""
+        with self._lock:
+            for k, (t, _) in list(self._tokens.items()):
+                if token is None or t == token: del self._tokens[k]
+
+silae_tokens = SilaeTokenProvider()
+
+def get_silae_token(config):
+    return silae_tokens.get(config)
+
+def post_silae_ecritures(token, config, dossier, start, end, stream=False):
+    url = f"{SILAE_API_URL}/payroll/v1/EcrituresComptables/EcrituresComptables4"
     body = {"numeroDossier": str(dossier), "periodeDebut": start.strftime('%Y-%m-%d'), "periodeFin": end.strftime('%Y-%m-%d'), "avecToutesLesRepartitionsAnalytiques": False}
-    r = requests.post(url, headers=headers, json=body)
+    for attempt in range(2):
+        headers = {"Authorization": f"Bearer {token}", "Ocp-Apim-Subscription-Key": config['subscription_key'], "Content-Type": "application/json", "dossiers": str(dossier)}
+        r = http_post(url, headers=headers, json=body, stream=stream)
+        if r.status_code != 401 or attempt: break
+        # Jeton expiré ou révoqué côté Silae : on le renouvelle une fois
+        r.close()
+        silae_tokens.invalidate(token)
+        token = silae_tokens.get(config)
     r.raise_for_status()
-    return r.json()
+    return r
+
+def get_silae_ecritures(token, config, dossier, start, end):
+    with span("silae_ecritures"):
+        return post_silae_ecritures(token, config, dossier, start, end).json()
+
+def stream_silae_ecritures(token, config, dossier, start, end):
+    """Envoie la requête tout de suite (erreurs Silae levées ici) et retourne le flux des lignes.
+
+    La réponse est lue au fil de l'eau par l'étape suivante, sans charger tout le JSON.
+    """
+    # Seule l'attente des en-têtes est mesurée : le corps est lu par l'étape suivante
+    with span("silae_ecritures"):
+        r = post_silae_ecritures(token, config, dossier, start, end, stream=True)
+    r.raw.decode_content = True
+    return iter_streamed_lines(r)
+
+def iter_streamed_lines(r):
+    try:
+        yield from ijson.items(r.raw, 'ruptures.item.ecritures.item', use_float=True)
+    finally:
+        r.close()
+
+def fetch_silae_ecritures(token, config, dossier, start, end):
+    # Flux de lignes si PAYFLOW_SILAE_STREAMING=1 (et ijson installé), sinon réponse complète
+    fetch = stream_silae_ecritures if SILAE_STREAMING else get_silae_ecritures
+    return fetch(token, config, dossier, start, end)
+
+def iter_silae_lines(ecritures):
+    # CORRECTIF PROVISIONS & NONETYPE : toutes les ruptures, 'or []' si une rupture est vide/null
+    for rupture in ecritures.get('ruptures') or []:
+        yield from rupture.get('ecritures') or []
+
+def read_silae_lines(ecritures):
+    """Lignes (compte, libellé, débit, crédit) depuis la réponse complète (dict) ou un flux de lignes."""
+    lines = iter_silae_lines(ecritures) if isinstance(ecritures, dict) else ecritures
+    return [(l['compte'], l['libelle'], l['valeur'] if l['sens'] == 'D' else 0.0, l['valeur'] if l['sens'] == 'C' else 0.0) for l in lines]
+
+# tracemalloc est global au processus : un seul bloc mesuré à la fois
+_memory_lock = threading.Lock()
+
+@contextmanager
+def memory_peak(label):
+    """Affiche le pic mémoire Python du bloc (PAYFLOW_TRACE_MEMORY=1, imports mesurés un par un)."""
+    if not TRACE_MEMORY:
+        yield
+        return
+    with _memory_lock:
+        # Traçage déjà lancé par ailleurs (banc d'essai) : on le laisse actif en sortant
+        started = not tracemalloc.is_tracing()
+        if started: tracemalloc.start()
+        tracemalloc.reset_peak()
+        try:
+            yield
+        finally:
+            peak = tracemalloc.get_traced_memory()[1]
+            if started: tracemalloc.stop()
+            print(f"[mémoire] {label} ({'flux' if SILAE_STREAMING else 'complet'}): pic {peak / 1024 / 1024:.1f} Mo")
+
+def resolve_account_ids(session, codes, company_id, cache_key=None):
+    """Résout tous les codes comptables en un seul search_read. Retourne {code: id}.
+
+    Avec `cache_key`, seuls les codes absents du cache sont demandés à Odoo.
+    """
+    chart = odoo_chart_cache.get(cache_key) if cache_key else {'accounts': {}, 'odoo18': None}
+    known = chart['accounts']
+    todo = sorted({c for c in codes if c not in known})
+    if todo:
+        odoo18 = chart['odoo18']
+        fields = {'fields': ['code']}
+        ctx = {'allowed_company_ids': [company_id], 'check_company': True}
+        if odoo18:
+            accounts = session.execute_kw('account.account', 'search_read', [[('code', 'in', todo)]], dict(fields, context=ctx))
+        else:
+            acc_domain = [('code', 'in', todo), ('company_id', '=', company_id)]
+            try:
+                accounts = session.execute_kw('account.account', 'search_read', [acc_domain], fields)
+                odoo18 = False
+            except xmlrpc.client.Fault as e:
+                # CORRECTIF ODOO 18 : plus de company_id sur account.account
+                if "company_id" not in str(e): raise
+                accounts = session.execute_kw('account.account', 'search_read', [[('code', 'in', todo)]], dict(fields, context=ctx))
+                odoo18 = True
+
+        fetched = {}
+        for acc in accounts:
+            fetched.setdefault(acc['code'], acc['id'])
+        known.update(fetched)
+        if cache_key: odoo_chart_cache.update(cache_key, accounts=fetched, odoo18=odoo18)
+    return {c: known[c] for c in codes if c in known}
 
-def import_to_odoo_auto(client_config, ecritures_data, period_str, entry_date):
+# --- REGISTRE DES IMPORTS ---
+def lines_hash(lignes, conf):
+    """Empreinte des lignes Silae normalisées (ordre ignoré) et de la destination Odoo."""
+    normalized = sorted((code, name, round(float(debit), 2), round(float(credit), 2)) for code, name, debit, credit in lignes)
+    target = [conf.get('odoo_host'), conf.get('database_odoo'), conf.get('odoo_company_id'), conf.get('journal_paie_odoo')]
+    return hashlib.sha256(json.dumps([target, normalized], ensure_ascii=False).encode()).hexdigest()
+
+def ledger_get(doc_id, period):
+    if not DB or not doc_id: return None
+    snap = DB.collection("payflow_ledger").document(f"{doc_id}_{period}").get()
+    return snap.to_dict() if snap.exists else None
+
+def ledger_put(doc_id, period, digest, move_id, line_count):
+    if not DB or not doc_id: return
+    try:
+        DB.collection("payflow_ledger").document(f"{doc_id}_{period}").set({
+            "client_doc_id": doc_id, "period": period, "hash": digest, "move_id": move_id,
+            "lines": line_count, "imported_at": datetime.utcnow()
+        })
+    except Exception as e:
+        # La pièce est créée : on ne transforme pas le succès en erreur
+        print(f"Erreur registre {doc_id}_{period}: {e}")
+
+def import_to_odoo_auto(client_config, ecritures_data, period_str, entry_date, doc_id=None, force=False):
+    try:
+        prepared = prepare_odoo_move(client_config, ecritures_data, period_str, entry_date, doc_id, force)
+        if isinstance(prepared, tuple): return prepared
+        return create_odoo_move(prepared)
+    except Exception as e:
+        # Un id en cache peut être obsolète (compte/journal supprimé) : on repart de zéro
+        odoo_chart_cache.invalidate(client_config.get('odoo_host'), client_config.get('database_odoo'), client_config.get('odoo_company_id'))
+        return "ERROR_ODOO_RPC", str(e)
+
+def prepare_odoo_move(client_config, ecritures_data, period_str, entry_date, doc_id=None, force=False):
+    """Lignes Silae, registre, journal et comptes. Retourne la pièce à créer, ou (statut, message)."""
     host = client_config.get('odoo_host')
     db_name = client_config.get('database_odoo')
     username = client_config.get('odoo_login')
@@ -126,134 +800,739 @@ def import_to_odoo_auto(client_config, ecritures_data, period_str, entry_date):
     if not all([host, db_name, username, password, journal_code, company_id]):
         return "ERROR_CONFIG", "Configuration Odoo incomplète."
 
+    if isinstance(ecritures_data, dict) and not ecritures_data.get('ruptures'): return "SUCCESS_EMPTY", "Aucune donnée Silae."
+    
+    # Réponse complète ou flux de lignes (PAYFLOW_SILAE_STREAMING)
+    lignes = read_silae_lines(ecritures_data)
+
+    if not lignes: return "SUCCESS_EMPTY", "Journal Silae vide."
+
+    # Registre : période déjà importée avec les mêmes données -> rien à faire côté Odoo
+    digest = lines_hash(lignes, client_config)
+    previous = ledger_get(doc_id, period_str)
+    if previous and previous.get('hash') == digest and not force:
+        return "SUCCESS_UNCHANGED", f"Déjà importé (pièce ID {previous.get('move_id')}), données Silae inchangées."
+
+    # Session partagée : plusieurs clients d'une même base multi-société ne s'authentifient qu'une fois
+    session = odoo_sessions.get(host, db_name, username, password)
+    if not session.authenticate(): return "ERROR_AUTH", "Échec authentification Odoo."
+    
+    cache_key = OdooChartCache.key(client_config)
+    journal_id = odoo_chart_cache.get(cache_key)['journals'].get(journal_code)
+    if not journal_id:
+        with span("odoo_journal"):
+            j_ids = session.execute_kw('account.journal', 'search', [[('code', '=', journal_code)]])
+        if not j_ids: return "ERROR_JOURNAL", f"Journal {journal_code} introuvable."
+        journal_id = j_ids[0]
+        odoo_chart_cache.update(cache_key, journals={journal_code: journal_id})
+
+    # CORRECTIF PERF : résolution groupée des comptes (une seule requête, cache par base)
+    with span("odoo_accounts"):
+        acc_map = resolve_account_ids(session, [l[0] for l in lignes], company_id, cache_key)
+    missing = sorted({l[0] for l in lignes if l[0] not in acc_map})
+    if missing: return "ERROR_ACCOUNT", f"Compte(s) {', '.join(missing)} introuvable(s)."
+
+    line_count = len(lignes)
+    move_lines = [(0, 0, {'account_id': acc_map[code], 'name': name, 'debit': debit, 'credit': credit}) for code, name, debit, credit in lignes]
+    del lignes
+
+    # LIBELLÉ PERSONNALISÉ
     try:
-        if not ecritures_data.get('ruptures'): return "SUCCESS_EMPTY", "Aucune donnée Silae."
-        
-        # CORRECTIF PROVISIONS : On fusionne toutes les ruptures
-        # AJOUT CORRECTIF "NoneType" : On utilise 'or []' pour éviter de planter si une rupture est vide/null
-        lignes = []
-        for rupture in ecritures_data['ruptures']:
-            lignes.extend(rupture.get('ecritures') or [])
+        y, m = period_str.split('-')
+        months = ["", "JANVIER", "FEVRIER", "MARS", "AVRIL", "MAI", "JUIN", "JUILLET", "AOUT", "SEPTEMBRE", "OCTOBRE", "NOVEMBRE", "DECEMBRE"]
+        month_name = months[int(m)]
+        label_ref = f"SALAIRES {month_name} {y}"
+    except:
+        label_ref = f"SALAIRES {period_str}"
+
+    move_vals = {
+        'journal_id': journal_id,
+        'ref': label_ref,
+        'date': entry_date.strftime('%Y-%m-%d'),
+        'line_ids': move_lines,
+        'company_id': company_id
+    }
+    return {"session": session, "move_vals": move_vals, "digest": digest, "previous": previous,
+            "line_count": line_count, "doc_id": doc_id, "period": period_str}
+
+def create_odoo_move(prepared):
+    """Crée la pièce préparée par prepare_odoo_move et l'inscrit au registre."""
+    with span("odoo_create"):
+        move_id = prepared["session"].execute_kw('account.move', 'create', [prepared["move_vals"]])
+    label_ref = prepared["move_vals"]["ref"]
+    previous = prepared["previous"]
+    ledger_put(prepared["doc_id"], prepared["period"], prepared["digest"], move_id, prepared["line_count"])
+    if previous:
+        reason = "réimport forcé" if previous.get('hash') == prepared["digest"] else "données modifiées"
+        return "SUCCESS", f"Pièce créée ID {move_id} ({label_ref}), {reason} depuis la pièce ID {previous.get('move_id')}."
+    return "SUCCESS", f"Pièce créée ID {move_id} ({label_ref})"
+
+# --- JOURNAL FIRESTORE BUFFERISÉ ---
+LOG_FLUSH_SIZE = int(os.environ.get("PAYFLOW_LOG_FLUSH_SIZE", "50"))
+LOG_FLUSH_INTERVAL = float(os.environ.get("PAYFLOW_LOG_FLUSH_INTERVAL", "5"))
+LOG_PENDING_MAX = int(os.environ.get("PAYFLOW_LOG_PENDING_MAX", "5000"))
+
+def merge_update(previous, data):
+    """Fusionne deux écritures `merge=True` d'un même document (Increment, ArrayUnion, sous-dictionnaires)."""
+    from google.cloud import firestore
+    out = dict(previous)
+    for key, value in data.items():
+        prev = out.get(key)
+        if isinstance(value, firestore.Increment) and isinstance(prev, firestore.Increment):
+            out[key] = firestore.Increment(prev.value + value.value)
+        elif isinstance(value, firestore.ArrayUnion) and isinstance(prev, firestore.ArrayUnion):
+            out[key] = firestore.ArrayUnion(list(prev.values) + [v for v in value.values if v not in prev.values])
+        elif isinstance(value, dict) and isinstance(prev, dict):
+            out[key] = merge_update(prev, value)
+        else:
+            out[key] = value
+    return out
+
+class LogBuffer:
+    """Tampon des écritures de journal, envoyées par lots Firestore (WriteBatch).
 
-        if not lignes: return "SUCCESS_EMPTY", "Journal Silae vide."
+    Le lot part dès `max_size` entrées ou toutes les `interval` secondes ; en cas d'échec
+    les entrées sont remises en tête du tampon et renvoyées au flush suivant. Au-delà de
+    `max_pending` entrées en attente (Firestore indisponible), les plus anciennes sont abandonnées.
+    """
 
-        url_common = f"https://{host}/xmlrpc/2/common"
-        url_object = f"https://{host}/xmlrpc/2/object"
+    def __init__(self, client, collection, max_size=LOG_FLUSH_SIZE, interval=LOG_FLUSH_INTERVAL, max_pending=LOG_PENDING_MAX):
+        self.client = client
+        self.collection = collection
+        self.max_size = min(max_size, 500)  # limite Firestore par lot
+        self.interval = interval
+        self.max_pending = max(max_pending, self.max_size)
+        self._pending = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._timer = None
 
-        common = xmlrpc.client.ServerProxy(url_common)
-        uid = common.authenticate(db_name, username, password, {})
-        if not uid: return "ERROR_AUTH", "Échec authentification Odoo."
+    @staticmethod
+    def new_id(*parts):
+        # Microsecondes + suffixe aléatoire : deux entrées de la même seconde ne s'écrasent plus
+        return "_".join([*map(str, parts), datetime.now().strftime('%Y%m%dT%H%M%S%f'), uuid.uuid4().hex[:8]])
+
+    def add(self, doc_id, data, collection=None, merge=False):
+        with self._lock:
+            self._pending.append((collection or self.collection, doc_id, data, merge))
+            full = len(self._pending) >= self.max_size
+            if not self._timer:
+                self._timer = threading.Thread(target=self._run_timer, daemon=True)
+                self._timer.start()
+        if full: self.flush()
+
+    @staticmethod
+    def coalesce(entries):
+        """Une seule écriture par document et par lot : les `merge=True` successifs sont fusionnés."""
+        out, index = [], {}
+        for collection, doc_id, data, merge in entries:
+            key = (collection, doc_id)
+            if merge and key in index:
+                i = index[key]
+                out[i] = (collection, doc_id, merge_update(out[i][2], data), merge)
+                continue
+            if merge: index[key] = len(out)
+            else: index.pop(key, None)
+            out.append((collection, doc_id, data, merge))
+        return out
+
+    def _run_timer(self):
+        while True:
+            time.sleep(self.interval)
+            self.flush()
+
+    def flush(self, retries=0):
+        """Envoie le tampon. Avec `retries`, réessaie (backoff) avant de rendre la main."""
+        for attempt in range(retries + 1):
+            with self._flush_lock:
+                with self._lock:
+                    entries, self._pending = self._pending, []
+                if not entries: return True
+                entries = self.coalesce(entries)
+                try:
+                    while entries:
+                        chunk = entries[:self.max_size]
+                        batch = self.client.batch()
+                        for collection, doc_id, data, merge in chunk:
+                            batch.set(self.client.collection(collection).document(doc_id), data, merge=merge)
+                        batch.commit()
+                        entries = entries[len(chunk):]
+                    return True
+                except Exception as e:
+                    print(f"Erreur écriture journal ({len(entries)} entrée(s) conservée(s)): {e}")
+                    with self._lock:
+                        self._pending = entries + self._pending
+                        dropped = len(self._pending) - self.max_pending
+                        if dropped > 0: del self._pending[:dropped]
+                    if dropped > 0: print(f"Tampon de journal plein : {dropped} entrée(s) les plus anciennes abandonnées")
+            if attempt < retries: time.sleep(min(2 ** attempt, 10))
+        return False
+
+def client_stats_update(name, period, status, msg, now):
+    """Compteurs agrégés par client (payflow_client_stats), mis à jour avec chaque entrée de journal."""
+    from google.cloud import firestore
+    update = {
+        "client_name": name, "last_status": status, "last_period": period,
+        "last_execution_time": now, "last_message": str(msg)[:300], "runs": firestore.Increment(1),
+        "periods": {period: {"last_status": status, "last_execution_time": now}}
+    }
+    if "SUCCESS" in status:
+        update["last_success_time"] = now
+        update["periods"][period]["last_success_time"] = now
+    elif "ERROR" in status or "CRASH" in status:
+        update["errors"] = firestore.Increment(1)
+    return update
+
+log_buffer = LogBuffer(DB, "payflow_logs")
+
+def log_execution(client_doc_id, client_name, period_str, status, message, timings=None):
+    if not DB: return
+    now = datetime.utcnow()
+    log_buffer.add(LogBuffer.new_id(client_doc_id, period_str), {
+        "client_doc_id": client_doc_id, "client_name": client_name,
+        "period": period_str, "execution_time": now,
+        "status": status, "message": message[:1500], "timings": timings or {}
+    })
+    log_buffer.add(client_doc_id, client_stats_update(client_name, period_str, status, message, now), collection="payflow_client_stats", merge=True)
 
-        models = xmlrpc.client.ServerProxy(url_object)
+# --- EXÉCUTION CONCURRENTE ---
+ROBOT_WORKERS = int(os.environ.get("PAYFLOW_ROBOT_WORKERS", "4"))
+ROBOT_MAX_PER_HOST = int(os.environ.get("PAYFLOW_ROBOT_MAX_PER_HOST", "1"))
+
+class HostLimiter:
+    """Limite le nombre d'imports simultanés vers un même serveur Odoo."""
+
+    def __init__(self, max_per_host=ROBOT_MAX_PER_HOST):
+        self.max_per_host = max(max_per_host, 1)
+        self._sems = {}
+        self._lock = threading.Lock()
+
+    def for_host(self, host):
+        with self._lock:
+            if host not in self._sems:
+                self._sems[host] = threading.BoundedSemaphore(self.max_per_host)
+            return self._sems[host]
+
+def process_client(doc, enc_key, silae_conf, period_str, first_day_prev, last_day_prev, limiter, force=False):
+    """Traite un client (déchiffrement, Silae, Odoo, log, alerte). Retourne le statut final."""
+    data = doc.to_dict()
+    name = data.get('nom', 'Inconnu')
+    doc_id = doc.id
+    email = data.get('odoo_login')
+    
+    print(f"Traitement: {name}")
+    trace = Trace(data.get('odoo_host'))
+    try:
+        with use_trace(trace), span("import"):
+            data['odoo_password'] = decrypt_data(data.get('odoo_password'), enc_key)
+            with memory_peak(f"{name} {period_str}"):
+                ecritures = fetch_silae_ecritures(get_silae_token(silae_conf), silae_conf, data['numero_dossier_silae'], first_day_prev, last_day_prev)
+                with limiter.for_host(data.get('odoo_host')):
+                    status, msg = import_to_odoo_auto(data, ecritures, period_str, last_day_prev, doc_id, force)
+        log_execution(doc_id, name, period_str, status, msg, trace.as_dict())
+        print(f"[{name}] {status}: {msg} {format_timings(trace)}")
         
-        j_ids = models.execute_kw(db_name, uid, password, 'account.journal', 'search', [[('code', '=', journal_code)]])
-        if not j_ids: return "ERROR_JOURNAL", f"Journal {journal_code} introuvable."
-        journal_id = j_ids[0]
+        if status.startswith("ERROR"):
+            send_error_email(email, name, period_str, msg)
+        return status
 
-        move_lines = []
-        for l in lignes:
-            # CORRECTIF ODOO 18
-            acc_domain = [('code', '=', l['compte']), ('company_id', '=', company_id)]
-            try:
-                acc_ids = models.execute_kw(db_name, uid, password, 'account.account', 'search', [acc_domain])
-            except xmlrpc.client.Fault as e:
-                if "company_id" in str(e):
-                    acc_domain = [('code', '=', l['compte'])]
-                    ctx = {'allowed_company_ids': [company_id], 'check_company': True}
-                    acc_ids = models.execute_kw(db_name, uid, password, 'account.account', 'search', [acc_domain], {'context': ctx})
-                else:
-                    raise e
-
-            if not acc_ids: return "ERROR_ACCOUNT", f"Compte {l['compte']} introuvable."
-            
-            move_lines.append((0, 0, {
-                'account_id': acc_ids[0],
-                'name': l['libelle'],
-                'debit': l['valeur'] if l['sens'] == 'D' else 0.0,
-                'credit': l['valeur'] if l['sens'] == 'C' else 0.0
-            }))
-
-        # LIBELLÉ PERSONNALISÉ
+    except Exception as e:
+        err = str(e)
+        print(f"[{name}] ERROR_CRASH: {err}")
+        log_execution(doc_id, name, period_str, "ERROR_CRASH", err, trace.as_dict())
+        send_error_email(email, name, period_str, f"Crash: {err}")
+        return "ERROR_CRASH"
+
+def run_clients(clients, workers, task):
+    """Exécute `task(doc)` pour chaque client avec `workers` threads. Retourne {doc_id: statut}."""
+    if workers <= 1 or len(clients) <= 1:
+        return {doc.id: task(doc) for doc in clients}
+    results = {}
+    with ThreadPoolExecutor(max_workers=min(workers, len(clients))) as pool:
+        futures = {pool.submit(task, doc): doc.id for doc in clients}
+        for fut in as_completed(futures):
+            results[futures[fut]] = fut.result()
+    return results
+
+def print_run_summary(results, elapsed):
+    failures = {k: v for k, v in results.items() if v.startswith("ERROR")}
+    skipped = [k for k, v in results.items() if v == "SKIPPED_DEADLINE"]
+    done = len(results) - len(skipped)
+    rate = done / elapsed * 60 if elapsed > 0 else 0.0
+    print(f"--- Bilan : {done} client(s) en {elapsed:.1f}s ({rate:.1f}/min), {done - len(failures)} OK, {len(failures)} échec(s), {len(skipped)} reporté(s) ---")
+    for doc_id, status in failures.items():
+        print(f"  ✗ {doc_id}: {status}")
+    conns = connection_stats()
+    print(f"Connexions : Silae {conns['silae']['connections']} ouverte(s) pour {conns['silae']['requests']} requête(s), Odoo {conns['odoo']}")
+    return {"clients": done, "failures": failures, "skipped": skipped, "elapsed_s": round(elapsed, 1), "connections": conns}
+
+# --- PIPELINE ---
+ROBOT_PIPELINE = os.environ.get("PAYFLOW_ROBOT_PIPELINE", "0") == "1"
+PIPELINE_QUEUE_SIZE = int(os.environ.get("PAYFLOW_PIPELINE_QUEUE_SIZE", "4"))
+PIPELINE_SILAE_WORKERS = int(os.environ.get("PAYFLOW_PIPELINE_SILAE_WORKERS", "2"))
+PIPELINE_ODOO_WORKERS = int(os.environ.get("PAYFLOW_PIPELINE_ODOO_WORKERS", "2"))
+_STOP = object()
+
+class Pipeline:
+    """Étapes reliées par des files bornées, chacune avec ses threads.
+
+    `stages` : liste de (nom, fonction(ctx) -> ctx, nb_workers). Un ctx qui a déjà un
+    `result` traverse les étapes suivantes sans traitement, sauf la dernière (journal).
+    """
+
+    def __init__(self, stages, queue_size=PIPELINE_QUEUE_SIZE):
+        self.stages = stages
+        self.queues = [queue.Queue(maxsize=queue_size) for _ in stages]
+        self.stats = {name: {"items": 0, "busy_s": 0.0, "max_depth": 0} for name, _, _ in stages}
+        self._lock = threading.Lock()
+
+    def _put(self, i, ctx):
+        self.queues[i].put(ctx)
+        if ctx is not _STOP:
+            name = self.stages[i][0]
+            with self._lock:
+                st = self.stats[name]
+                st["max_depth"] = max(st["max_depth"], self.queues[i].qsize())
+
+    def _worker(self, i, remaining, out):
+        name, func, _ = self.stages[i]
+        last = i == len(self.stages) - 1
+        while True:
+            ctx = self.queues[i].get()
+            if ctx is _STOP:
+                with self._lock:
+                    remaining[i] -= 1
+                    closing = remaining[i] == 0
+                if closing and not last:
+                    for _ in range(self.stages[i + 1][2]): self._put(i + 1, _STOP)
+                return
+            started = time.monotonic()
+            if last or ctx.get("result") is None:
+                # Chaque client garde sa trace d'une étape (et d'un thread) à l'autre
+                try:
+                    with use_trace(ctx.get("trace")), span(name):
+                        ctx = func(ctx)
+                except Exception as e:
+                    # Le thread doit survivre : sinon _STOP n'est jamais transmis et la chaîne se bloque
+                    print(f"[pipeline] étape {name} : {e}")
+                    ctx["result"] = ("ERROR_CRASH", str(e))
+            with self._lock:
+                self.stats[name]["items"] += 1
+                self.stats[name]["busy_s"] += time.monotonic() - started
+            if last: out.append(ctx)
+            else: self._put(i + 1, ctx)
+
+    def run(self, items, admit=None):
+        """Fait passer `items` dans la chaîne. `admit(item)` -> False laisse l'item hors de la chaîne."""
+        remaining = [workers for _, _, workers in self.stages]
+        out = []
+        threads = [threading.Thread(target=self._worker, args=(i, remaining, out), daemon=True)
+                   for i, (_, _, workers) in enumerate(self.stages) for _ in range(workers)]
+        for t in threads: t.start()
+        rejected = []
+        for item in items:
+            if admit and not admit(item): rejected.append(item)
+            else: self._put(0, item)
+        for _ in range(self.stages[0][2]): self._put(0, _STOP)
+        for t in threads: t.join()
+        return out, rejected
+
+    def report(self):
+        for name, st in self.stats.items():
+            print(f"  étape {name:<8} {st['items']:>4} élément(s), occupée {st['busy_s']:.1f}s, file max {st['max_depth']}")
+        return self.stats
+
+def run_pipeline(clients, enc_key, silae_conf, period_str, first_day, last_day, limiter, deadline, force=False, on_done=None):
+    """Traite les clients en chaîne : config -> Silae -> comptes -> création Odoo -> journal/alerte.
+
+    Les téléchargements Silae des clients suivants avancent pendant les écritures Odoo.
+    Retourne ({doc_id: statut}, statistiques par étape).
+    """
+    def config(ctx):
         try:
-            y, m = period_str.split('-')
-            months = ["", "JANVIER", "FEVRIER", "MARS", "AVRIL", "MAI", "JUIN", "JUILLET", "AOUT", "SEPTEMBRE", "OCTOBRE", "NOVEMBRE", "DECEMBRE"]
-            month_name = months[int(m)]
-            label_ref = f"SALAIRES {month_name} {y}"
-        except:
-            label_ref = f"SALAIRES {period_str}"
-
-        move_vals = {
-            'journal_id': journal_id,
-            'ref': label_ref,
-            'date': entry_date.strftime('%Y-%m-%d'),
-            'line_ids': move_lines,
-            'company_id': company_id
-        }
-        
-        move_id = models.execute_kw(db_name, uid, password, 'account.move', 'create', [move_vals])
-        return "SUCCESS", f"Pièce créée ID {move_id} ({label_ref})"
+            data = ctx["doc"].to_dict()
+            ctx["trace"] = Trace(data.get('odoo_host'))
+            ctx.update(data=data, name=data.get('nom', 'Inconnu'), email=data.get('odoo_login'))
+            data['odoo_password'] = decrypt_data(data.get('odoo_password'), enc_key)
+            print(f"Traitement: {ctx['name']}")
+        except Exception as e:
+            ctx["result"] = ("ERROR_CRASH", str(e))
+        return ctx
+
+    def postpone(ctx):
+        # Échéance vérifiée à chaque étape distante avant écriture Odoo : les files peuvent retenir des clients longtemps
+        if not deadline.expired(): return False
+        ctx.pop("ecritures", None)
+        ctx["result"] = ("SKIPPED_DEADLINE", "Échéance proche, client reporté.")
+        return True
+
+    def silae(ctx):
+        if postpone(ctx): return ctx
+        try:
+            ecritures = fetch_silae_ecritures(get_silae_token(silae_conf), silae_conf, ctx["data"]['numero_dossier_silae'], first_day, last_day)
+            # En mode flux, on consomme la réponse ici pour libérer la connexion Silae
+            ctx["ecritures"] = ecritures if isinstance(ecritures, dict) else list(ecritures)
+        except Exception as e:
+            ctx["result"] = ("ERROR_CRASH", str(e))
+        return ctx
+
+    def on_odoo_error(ctx, e):
+        data = ctx["data"]
+        odoo_chart_cache.invalidate(data.get('odoo_host'), data.get('database_odoo'), data.get('odoo_company_id'))
+        ctx["result"] = ("ERROR_ODOO_RPC", str(e))
+
+    def accounts(ctx):
+        if postpone(ctx): return ctx
+        try:
+            with limiter.for_host(ctx["data"].get('odoo_host')):
+                prepared = prepare_odoo_move(ctx["data"], ctx.pop("ecritures"), period_str, last_day, ctx["doc"].id, force)
+            if isinstance(prepared, tuple): ctx["result"] = prepared
+            else: ctx["prepared"] = prepared
+        except Exception as e:
+            on_odoo_error(ctx, e)
+        return ctx
+
+    def create(ctx):
+        try:
+            with limiter.for_host(ctx["data"].get('odoo_host')):
+                ctx["result"] = create_odoo_move(ctx.pop("prepared"))
+        except Exception as e:
+            on_odoo_error(ctx, e)
+        return ctx
+
+    def report(ctx):
+        doc_id, name = ctx["doc"].id, ctx.get("name", "Inconnu")
+        status, msg = ctx["result"]
+        # Client reporté : ni journal ni alerte, il sera repris au déclenchement suivant
+        if status == "SKIPPED_DEADLINE": return ctx
+        trace = ctx.get("trace")
+        log_execution(doc_id, name, period_str, status, msg, trace.as_dict() if trace else None)
+        print(f"[{name}] {status}: {msg} {format_timings(trace) if trace else ''}")
+        if status.startswith("ERROR"):
+            send_error_email(ctx.get("email"), name, period_str, f"Crash: {msg}" if status == "ERROR_CRASH" else msg)
+        if on_done: on_done(doc_id, status)
+        return ctx
+
+    pipeline = Pipeline([
+        ("config", config, 1),
+        ("silae", silae, PIPELINE_SILAE_WORKERS),
+        ("comptes", accounts, PIPELINE_ODOO_WORKERS),
+        ("odoo", create, PIPELINE_ODOO_WORKERS),
+        ("journal", report, 1),
+    ])
+    done, skipped = pipeline.run(({"doc": doc} for doc in clients), admit=lambda ctx: not deadline.expired())
+    results = {ctx["doc"].id: ctx["result"][0] for ctx in done}
+    results.update({ctx["doc"].id: "SKIPPED_DEADLINE" for ctx in skipped})
+    return results, pipeline.report()
+
+# --- ÉCHÉANCE & POINTS DE REPRISE ---
+ROBOT_TIMEOUT = int(os.environ.get("PAYFLOW_ROBOT_TIMEOUT", "540"))
+ROBOT_DEADLINE_MARGIN = int(os.environ.get("PAYFLOW_ROBOT_DEADLINE_MARGIN", "90"))
+
+class Deadline:
+    """Budget de temps de l'exécution : plus de nouveau client à moins de `margin` secondes de la fin."""
 
+    def __init__(self, budget=ROBOT_TIMEOUT, margin=ROBOT_DEADLINE_MARGIN):
+        self.end = time.monotonic() + budget
+        self.margin = margin
+
+    def remaining(self):
+        return self.end - time.monotonic()
+
+    def expired(self):
+        return self.remaining() < self.margin
+
+def period_bounds(period_str):
+    first = datetime.strptime(period_str, "%Y-%m")
+    next_m = first.replace(year=first.year+1, month=1) if first.month == 12 else first.replace(month=first.month+1)
+    return first, next_m - timedelta(days=1)
+
+def open_checkpoint(run_id, period_str, day):
+    """Crée (ou relit) le point de reprise Firestore d'une exécution. Retourne les doc ids déjà traités."""
+    ref = DB.collection("payflow_runs").document(run_id)
+    snap = ref.get()
+    if snap.exists:
+        return set(snap.to_dict().get('completed') or [])
+    ref.set({"run_id": run_id, "period": period_str, "jour_transfert": day, "completed": [],
+             "status": "PARTIAL", "started_at": datetime.utcnow(), "updated_at": datetime.utcnow()})
+    return set()
+
+def mark_client_done(run_id, doc_id, status):
+    """Ajoute le client au point de reprise s'il est importé ; un client en erreur sera retenté."""
+    from google.cloud import firestore
+    if not status.startswith("SUCCESS"): return
+    # Via le tampon de journal : une seule écriture du document d'exécution par lot
+    log_buffer.add(run_id, {"completed": firestore.ArrayUnion([doc_id]), "updated_at": datetime.utcnow()},
+                   collection="payflow_runs", merge=True)
+
+def close_checkpoint(run_id, status):
+    try:
+        DB.collection("payflow_runs").document(run_id).update({"status": status, "updated_at": datetime.utcnow()})
     except Exception as e:
-        return "ERROR_ODOO_RPC", str(e)
+        print(f"Erreur point de reprise {run_id}: {e}")
 
-def log_execution(client_doc_id, client_name, period_str, status, message):
-    if not DB: return
+def pending_runs():
+    """Exécutions interrompues (échéance atteinte) à reprendre, plus anciennes d'abord."""
     try:
-        log_id = f"{client_doc_id}_{period_str}_{datetime.now().strftime('%Y%m%dT%H%M%S')}"
-        DB.collection("payflow_logs").document(log_id).set({
-            "client_doc_id": client_doc_id, "client_name": client_name,
-            "period": period_str, "execution_time": datetime.utcnow(),
-            "status": status, "message": message[:1500]
-        })
+        runs = [d.to_dict() for d in DB.collection("payflow_runs").where("status", "==", "PARTIAL").stream()]
     except Exception as e:
-        print(f"Erreur Log: {e}")
+        print(f"Erreur lecture points de reprise: {e}")
+        return []
+    return sorted(runs, key=lambda r: r['run_id'])
+
+def clients_for_day(day):
+    return list(DB.collection("payflow_clients").where("jour_transfert", "==", day).stream())
+
+def process_run(run_id, period_str, day, clients, enc_key, silae_conf, limiter, deadline, force=False):
+    """Traite les clients d'un jour de transfert pour une période, en sautant ceux déjà faits."""
+    completed = open_checkpoint(run_id, period_str, day)
+    clients = [doc for doc in clients if doc.id not in completed]
+    if completed: print(f"Reprise {run_id} : {len(completed)} client(s) déjà traité(s), {len(clients)} restant(s)")
+    first_day, last_day = period_bounds(period_str)
+
+    if ROBOT_PIPELINE:
+        results, _ = run_pipeline(clients, enc_key, silae_conf, period_str, first_day, last_day, limiter, deadline, force,
+                                  on_done=lambda doc_id, status: mark_client_done(run_id, doc_id, status))
+    else:
+        def task(doc):
+            if deadline.expired(): return "SKIPPED_DEADLINE"
+            status = process_client(doc, enc_key, silae_conf, period_str, first_day, last_day, limiter, force)
+            mark_client_done(run_id, doc.id, status)
+            return status
+
+        results = run_clients(clients, ROBOT_WORKERS, task)
+    # Clients importés enregistrés avant de clore le point de reprise
+    log_buffer.flush(retries=3)
+    close_checkpoint(run_id, "PARTIAL" if "SKIPPED_DEADLINE" in results.values() else "DONE")
+    return results
+
+def current_run():
+    """Période à importer (mois précédent), jour de transfert courant et identifiant d'exécution."""
+    today = datetime.utcnow()
+    last_day_prev = today.replace(day=1) - timedelta(days=1)
+    period_str = last_day_prev.strftime('%Y-%m')
+    return period_str, today.day, f"{period_str}_J{today.day:02d}"
+
+def get_silae_config():
+    return {k: get_secret(f"SILAE_{k.upper()}") for k in ["client_id", "client_secret", "subscription_key"]}
 
 def process_monthly_import(event, context):
+    startup_profile.called()
     print(f"--- Démarrage PayFlow Robot ---")
-    today = datetime.utcnow()
-    current_day = today.day
-    first_day_curr = today.replace(day=1)
-    last_day_prev = first_day_curr - pd.Timedelta(days=1)
-    first_day_prev = last_day_prev.replace(day=1)
-    period_str = first_day_prev.strftime('%Y-%m')
+    deadline = Deadline()
+    period_str, current_day, run_id = current_run()
+    attributes = (event or {}).get('attributes') or {}
+
+    # Réimport même si les données Silae n'ont pas changé : attribut force_reimport=1
+    force = bool(attributes.get('force_reimport'))
+
+    # Rotation de secret : publier le message avec l'attribut refresh_secrets=1
+    if attributes.get('refresh_secrets'):
+        secrets_cache.refresh()
     
+    # Trace de l'exécution (secrets, jeton, clients) ; chaque client a la sienne dans son journal
+    run_trace = Trace()
     try:
-        enc_key = get_encryption_key()
-        silae_conf = {k: get_secret(f"SILAE_{k.upper()}") for k in ["client_id", "client_secret", "subscription_key"]}
+        with use_trace(run_trace), span("secrets"):
+            enc_key = get_encryption_key()
+            silae_conf = get_silae_config()
     except Exception as e:
         print(f"CRITIQUE: {e}")
         return
 
     if not DB: return
     try:
-        clients = list(DB.collection("payflow_clients").where("jour_transfert", "==", current_day).stream())
+        # Relance complète du jour : publier le message avec l'attribut reset_checkpoint=1
+        if attributes.get('reset_checkpoint'):
+            DB.collection("payflow_runs").document(run_id).delete()
+        # Exécutions interrompues d'abord, puis celle du jour
+        runs = [(r['run_id'], r['period'], r['jour_transfert']) for r in pending_runs() if r['run_id'] != run_id]
+        runs = [(rid, period, day, clients_for_day(day)) for rid, period, day in runs]
+        # Aucun client du jour : pas de point de reprise créé pour cette exécution
+        today_clients = clients_for_day(current_day)
+        if today_clients: runs.append((run_id, period_str, current_day, today_clients))
     except: return
 
-    if not clients:
+    # Ni jeton Silae ni écriture Firestore si aucun client n'est à traiter
+    if not any(clients for *_, clients in runs):
+        # Exécutions interrompues dont les clients ont disparu : rien à reprendre
+        for rid, *_ in runs: close_checkpoint(rid, "DONE")
         print("Rien à traiter.")
         return
 
     try:
-        token = get_silae_token(silae_conf)
+        # Jeton partagé (cache processus), renouvelé automatiquement avant expiration
+        with use_trace(run_trace):
+            get_silae_token(silae_conf)
     except: return
 
-    for doc in clients:
-        data = doc.to_dict()
-        name = data.get('nom', 'Inconnu')
-        doc_id = doc.id
-        email = data.get('odoo_login')
-        
-        print(f"Traitement: {name}")
+    # Secrets et jeton Silae récupérés une seule fois, partagés par les workers
+    started = time.monotonic()
+    limiter = HostLimiter()
+    results = {}
+    with use_trace(run_trace), span("clients"):
+        for rid, period, day, clients in runs:
+            try:
+                results.update(process_run(rid, period, day, clients, enc_key, silae_conf, limiter, deadline, force))
+            except Exception as e:
+                print(f"Erreur exécution {rid}: {e}")
+    # Les journaux restants partent avant la fin de la fonction (CPU coupé ensuite)
+    with use_trace(run_trace), span("journal_flush"):
+        log_buffer.flush(retries=3)
+
+    if not results:
+        print("Rien à traiter.")
+        return
+    summary = print_run_summary(results, time.monotonic() - started)
+    print(f"Durées : {format_timings(run_trace)}")
+    summary["timings"] = run_trace.as_dict()
+    return summary
+
+# --- RÉPARTITION PAR CLIENT (FAN-OUT) ---
+WORK_TOPIC = os.environ.get("PAYFLOW_WORK_TOPIC", "payflow-work-items")
+WORK_ITEM_LEASE = int(os.environ.get("PAYFLOW_WORK_ITEM_LEASE", "600"))
+
+class WorkQueue(ABC):
+    """File de travail : un élément par client et période ({doc_id, period, run_id, force})."""
+
+    @abstractmethod
+    def publish(self, item):
+        ...
+
+    def flush(self):
+        pass
+
+class PubSubWorkQueue(WorkQueue):
+    """Publication sur un topic Pub/Sub ; chaque message déclenche `process_work_item`."""
+
+    def __init__(self, topic=WORK_TOPIC):
         try:
-            data['odoo_password'] = decrypt_data(data.get('odoo_password'), enc_key)
-            ecritures = get_silae_ecritures(token, silae_conf, data['numero_dossier_silae'], first_day_prev, last_day_prev)
-            status, msg = import_to_odoo_auto(data, ecritures, period_str, last_day_prev)
-            log_execution(doc_id, name, period_str, status, msg)
-            
-            if status.startswith("ERROR"):
-                send_error_email(email, name, period_str, msg)
+            from google.cloud import pubsub_v1
+        except ImportError:
+            raise Exception("'google-cloud-pubsub' manquant")
+        self.publisher = pubsub_v1.PublisherClient()
+        self.topic_path = self.publisher.topic_path(os.environ.get("GCP_PROJECT"), topic)
+        self._futures = []
 
-        except Exception as e:
-            err = str(e)
-            log_execution(doc_id, name, period_str, "ERROR_CRASH", err)
-            send_error_email(email, name, period_str, f"Crash: {err}")
\ No newline at end of file
+    def publish(self, item):
+        self._futures.append(self.publisher.publish(self.topic_path, json.dumps(item).encode("utf-8")))
+
+    def flush(self):
+        # On attend la confirmation de chaque message avant de rendre la main
+        for fut in self._futures: fut.result(timeout=60)
+        self._futures = []
+
+class InMemoryWorkQueue(WorkQueue):
+    """File locale (exécution sur poste, tests) : `drain` traite les éléments dans ce processus."""
+
+    def __init__(self):
+        self.items = queue.Queue()
+
+    def publish(self, item):
+        self.items.put(item)
+
+    def drain(self, handler=None):
+        handler = handler or handle_work_item
+        results = {}
+        while not self.items.empty():
+            item = self.items.get()
+            results[item['doc_id']] = handler(item)
+        return results
+
+_claimed_locally = set()
+
+def claim_work_item(key):
+    """Réserve un élément (déduplication des messages redélivrés). False si déjà traité ou en cours."""
+    if not DB:
+        if key in _claimed_locally: return False
+        _claimed_locally.add(key)
+        return True
+    from google.cloud import firestore
+    ref = DB.collection("payflow_work_items").document(key)
+
+    @firestore.transactional
+    def claim(transaction):
+        now = datetime.now(timezone.utc)
+        snap = ref.get(transaction=transaction)
+        if snap.exists:
+            d = snap.to_dict()
+            if d.get('status') == "DONE": return False
+            # Élément en cours sur une autre instance, sauf si elle a dépassé son bail
+            if d.get('claimed_at') and (now - d['claimed_at']).total_seconds() < WORK_ITEM_LEASE: return False
+        transaction.set(ref, {"status": "RUNNING", "claimed_at": now})
+        return True
+
+    return claim(DB.transaction())
+
+def finish_work_item(key, status):
+    """Clôt l'élément : DONE si le client est importé, sinon libéré pour une nouvelle tentative."""
+    if not DB:
+        if not status.startswith("SUCCESS"): _claimed_locally.discard(key)
+        return
+    done = status.startswith("SUCCESS")
+    try:
+        DB.collection("payflow_work_items").document(key).set(
+            {"status": "DONE" if done else "FAILED", "result": status, "finished_at": datetime.utcnow(),
+             # Sans bail, un élément en échec est repris par la redistribution suivante
+             **({} if done else {"claimed_at": None})}, merge=True)
+    except Exception as e:
+        print(f"Erreur élément {key}: {e}")
+
+def handle_work_item(item):
+    """Traite un seul client pour une période. Retourne le statut final.
+
+    Un échec d'initialisation (secrets, lecture du client) libère l'élément et remonte
+    l'exception : Pub/Sub redistribue alors le message si les relances sont activées.
+    """
+    key = f"{item['run_id']}_{item['doc_id']}"
+    if not claim_work_item(key):
+        print(f"Élément {key} déjà traité ou en cours, ignoré.")
+        return "SKIPPED_DUPLICATE"
+    try:
+        enc_key = get_encryption_key()
+        silae_conf = get_silae_config()
+        doc = DB.collection("payflow_clients").document(item['doc_id']).get()
+        first_day, last_day = period_bounds(item['period'])
+    except Exception as e:
+        print(f"CRITIQUE élément {key}: {e}")
+        finish_work_item(key, "ERROR_SETUP")
+        raise
+    if not doc.exists:
+        status = "ERROR_CONFIG"
+        print(f"Client {item['doc_id']} introuvable.")
+    else:
+        # process_client journalise et alerte lui-même ses échecs (ERROR_*, ERROR_CRASH)
+        status = process_client(doc, enc_key, silae_conf, item['period'], first_day, last_day, HostLimiter(), bool(item.get('force')))
+    finish_work_item(key, status)
+    log_buffer.flush(retries=3)
+    return status
+
+def dispatch_monthly_import(event, context, work_queue=None):
+    """Point d'entrée « répartiteur » : publie un élément par client du jour au lieu de les traiter."""
+    startup_profile.called()
+    print(f"--- Répartition PayFlow Robot ---")
+    period_str, current_day, run_id = current_run()
+    attributes = (event or {}).get('attributes') or {}
+    if not DB: return
+    work_queue = work_queue or PubSubWorkQueue()
+    count = 0
+    for doc in DB.collection("payflow_clients").where("jour_transfert", "==", current_day).stream():
+        work_queue.publish({"doc_id": doc.id, "period": period_str, "run_id": run_id, "force": bool(attributes.get('force_reimport'))})
+        count += 1
+    work_queue.flush()
+    print(f"{count} élément(s) publié(s) pour {run_id}.")
+    return count
+
+def process_work_item(event, context):
+    """Point d'entrée « worker » : un message Pub/Sub = un client à importer."""
+    startup_profile.called()
+    try:
+        item = json.loads(base64.b64decode(event['data']).decode("utf-8"))
+        if not all(item.get(k) for k in ('run_id', 'doc_id', 'period')): raise ValueError("champs manquants")
+    except Exception as e:
+        # Pas d'exception : avec les relances activées, le message serait redistribué indéfiniment
+        print(f"Message ignoré (illisible) : {e} {str(event.get('data'))[:200]}")
+        return "SKIPPED_INVALID"
+    return handle_work_item(item)
+
+startup_profile.loaded()
@@ -1,19 +1,89 @@
+import time
+_IMPORT_STARTED = time.perf_counter()  # cf. PROFIL DE DÉMARRAGE
 import os
 import json
 import traceback
-from datetime import datetime
+import threading
+import uuid
+import tracemalloc
+from contextlib import contextmanager
+import hashlib
+import gzip
+import mimetypes
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from datetime import datetime, timedelta, timezone
 from typing import List, Optional, Dict, Any
 
-from fastapi import FastAPI, HTTPException, Header, Depends, Body
+from fastapi import FastAPI, HTTPException, Header, Depends, Body, Response
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, StreamingResponse, JSONResponse, PlainTextResponse
 from pydantic import BaseModel
-from google.cloud import firestore, secretmanager
 from cryptography.fernet import Fernet
 import xmlrpc.client
 import requests
-import pandas as pd
+
+try:
+    import ijson
+except ImportError:
+    ijson = None  # lecture en flux des réponses Silae indisponible
+try:
+    import brotli
+except ImportError:
+    brotli = None  # variantes .br des fichiers statiques indisponibles (gzip seul)
+
+# --- PROFIL DE DÉMARRAGE ---
+def process_uptime():
+    """Secondes depuis le lancement du processus (Linux), None ailleurs."""
+    try:
+        with open("/proc/self/stat") as f:
+            start_ticks = int(f.read().rsplit(")", 1)[1].split()[19])
+        with open("/proc/uptime") as f:
+            return float(f.read().split()[0]) - start_ticks / os.sysconf("SC_CLK_TCK")
+    except Exception:
+        return None
+
+class StartupProfile:
+    """Coût du démarrage à froid : import du module, création des clients GCP, premier appel.
+
+    Le résumé est affiché une seule fois, au premier appel (première requête HTTP).
+    """
+
+    def __init__(self, started):
+        self.started = started
+        self.steps = {}
+        self.first_call = None
+        self._lock = threading.Lock()
+
+    def record(self, label, seconds):
+        with self._lock: self.steps[label] = round(seconds * 1000, 1)
+
+    def loaded(self):
+        self.record("import", time.perf_counter() - self.started)
+
+    def called(self):
+        if self.first_call is not None: return
+        with self._lock:
+            if self.first_call is not None: return
+            uptime = process_uptime()
+            self.first_call = {"since_import_ms": round((time.perf_counter() - self.started) * 1000, 1),
+                               "since_process_ms": round(uptime * 1000) if uptime is not None else None}
+        print(f"Démarrage : {self.summary()}")
+
+    def summary(self):
+        with self._lock:
+            parts = [f"{label} {ms:.0f} ms" for label, ms in self.steps.items()]
+            first = self.first_call
+        if first:
+            process = f", {first['since_process_ms']} ms après le lancement du processus" if first['since_process_ms'] is not None else ""
+            parts.append(f"premier appel {first['since_import_ms']:.0f} ms après le début de l'import{process}")
+        return ", ".join(parts)
+
+    def as_dict(self):
+        with self._lock:
+            return {"steps_ms": dict(self.steps), "first_call": self.first_call}
+
+startup_profile = StartupProfile(_IMPORT_STARTED)
 
 # --- CONFIGURATION ---
 app = FastAPI(title="PayFlow API")
@@ -26,16 +96,69 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+class FirstRequestProfile:
+    """Middleware ASGI : signale la première requête au profil de démarrage."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and startup_profile.first_call is None: startup_profile.called()
+        await self.app(scope, receive, send)
+
+app.add_middleware(FirstRequestProfile)
+
 # --- CLIENTS GCP ---
-try:
+INIT_ERROR = "Erreur init GCP"
+
+class LazyClient:
+    """Client GCP créé au premier usage plutôt qu'à l'import (démarrage à froid plus court).
+
+    S'utilise comme le client lui-même ; faux (`if not db`) si la création a échoué,
+    échec retenu comme avec l'ancienne initialisation au chargement.
+    """
+
+    def __init__(self, name, factory):
+        self.name = name
+        self._factory = factory
+        self._client = None
+        self._failed = False
+        self._lock = threading.Lock()
+
+    def get(self):
+        if self._client is None and not self._failed:
+            with self._lock:
+                if self._client is None and not self._failed:
+                    started = time.perf_counter()
+                    try:
+                        self._client = self._factory()
+                    except Exception as e:
+                        print(f"{INIT_ERROR} ({self.name}): {e}")
+                        self._failed = True
+                    startup_profile.record(f"client {self.name}", time.perf_counter() - started)
+        return self._client
+
+    def __bool__(self):
+        return self.get() is not None
+
+    def __getattr__(self, attr):
+        client = self.get()
+        if client is None: raise Exception(f"Client {self.name} indisponible")
+        return getattr(client, attr)
+
+def _firestore_client():
+    from google.cloud import firestore
     project_id = os.environ.get("GCP_PROJECT") or os.environ.get("GCLOUD_PROJECT")
     # On précise le nom de la base Firestore si nécessaire
-    db = firestore.Client(project=project_id, database="payflow-db")
-    secret_client = secretmanager.SecretManagerServiceClient()
-except Exception as e:
-    print(f"Erreur init GCP: {e}")
-    db = None
-    secret_client = None
+    return firestore.Client(project=project_id, database="payflow-db")
+
+def _secret_client():
+    from google.cloud import secretmanager
+    return secretmanager.SecretManagerServiceClient()
+
+# Ni l'import gRPC ni la recherche des identifiants ne sont payés au chargement du module
+db = LazyClient("firestore", _firestore_client)
+secret_client = LazyClient("secretmanager", _secret_client)
 
 # --- MODÈLES PYDANTIC ---
 class LoginRequest(BaseModel):
@@ -55,108 +178,690 @@ class ClientConfig(BaseModel):
 class ManualImportRequest(BaseModel):
     client_doc_id: str
     periods: List[str]
+    force: bool = False  # réimporter même si les données Silae n'ont pas changé
+
+# --- CACHE SECRETS ---
+SECRET_TTL = int(os.environ.get("PAYFLOW_SECRET_TTL", "600"))
+SECRET_NEGATIVE_TTL = int(os.environ.get("PAYFLOW_SECRET_NEGATIVE_TTL", "60"))
+_MISSING = object()
+
+def is_not_found(error):
+    # google.api_core n'est importé qu'ici : une erreur Secret Manager l'a déjà chargé
+    from google.api_core.exceptions import NotFound
+    return isinstance(error, NotFound)
+
+class SecretCache:
+    """Cache mémoire des secrets Secret Manager.
+
+    Une valeur est servie pendant `ttl` secondes et rechargée en tâche de fond passé
+    `refresh_ratio` * `ttl`. Un secret inexistant est mémorisé `negative_ttl` secondes.
+    """
+
+    def __init__(self, fetch, ttl=SECRET_TTL, negative_ttl=SECRET_NEGATIVE_TTL, refresh_ratio=0.8):
+        self._fetch = fetch
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.refresh_ratio = refresh_ratio
+        self._entries = {}
+        self._refreshing = set()
+        self._lock = threading.Lock()
+
+    def get(self, name):
+        with self._lock:
+            entry = self._entries.get(name)
+        if entry:
+            value, loaded_at = entry
+            age = time.monotonic() - loaded_at
+            if value is _MISSING:
+                if age < self.negative_ttl: raise Exception(f"Secret {name} introuvable")
+            elif age < self.ttl:
+                if age > self.ttl * self.refresh_ratio: self._refresh_async(name)
+                return value
+        return self._load(name)
+
+    def _load(self, name):
+        try:
+            value = self._fetch(name)
+        except Exception as e:
+            if not is_not_found(e): raise
+            with self._lock: self._entries[name] = (_MISSING, time.monotonic())
+            raise Exception(f"Secret {name} introuvable")
+        with self._lock: self._entries[name] = (value, time.monotonic())
+        return value
+
+    def _refresh_async(self, name):
+        with self._lock:
+            if name in self._refreshing: return
+            self._refreshing.add(name)
+
+        def run():
+            try:
+                self._load(name)
+            except Exception as e:
+                # On garde l'ancienne valeur jusqu'à expiration
+                print(f"Rafraîchissement secret {name} échoué: {e}")
+            finally:
+                with self._lock: self._refreshing.discard(name)
+
+        threading.Thread(target=run, daemon=True).start()
+
+    def refresh(self, name=None, min_age=0):
+        """Force le rechargement (rotation de secret). `min_age` évite de relire un secret tout juste chargé."""
+        now = time.monotonic()
+        with self._lock:
+            for k in [k for k, (_, loaded_at) in self._entries.items() if (name is None or k == name) and now - loaded_at >= min_age]:
+                del self._entries[k]
+            _fernets.clear()
 
 # --- UTILITAIRES ---
-def get_secret(secret_name):
+def fetch_secret(secret_name):
     if not secret_client: raise Exception("Secret Client HS")
     project_id = os.environ.get("GCP_PROJECT")
     name = f"projects/{project_id}/secrets/{secret_name}/versions/latest"
     response = secret_client.access_secret_version(request={"name": name})
     return response.payload.data.decode("UTF-8").strip()
 
+secrets_cache = SecretCache(fetch_secret)
+_fernets = {}
+
+def get_secret(secret_name):
+    return secrets_cache.get(secret_name)
+
 def get_encryption_key():
     key_data = get_secret("PAYFLOW_ENCRYPTION_KEY")
     return key_data
 
+def get_fernet():
+    # L'objet Fernet est réutilisé tant que la clé ne change pas
+    key = get_encryption_key()
+    f = _fernets.get(key)
+    if not f:
+        f = _fernets[key] = Fernet(key)
+    return f
+
+def check_password(candidate):
+    if candidate == get_secret("PAYFLOW_PASSWORD"): return True
+    # Mot de passe peut-être changé depuis la mise en cache : on relit au plus toutes les 30 s
+    secrets_cache.refresh("PAYFLOW_PASSWORD", min_age=30)
+    return candidate == get_secret("PAYFLOW_PASSWORD")
+
 def verify_password(x_app_password: str = Header(None)):
     try:
-        correct_password = get_secret("PAYFLOW_PASSWORD")
+        valid = check_password(x_app_password)
     except Exception:
         raise HTTPException(status_code=500, detail="Erreur lecture secret")
         
-    if x_app_password != correct_password:
+    if not valid:
         raise HTTPException(status_code=401, detail="Mot de passe invalide")
     return True
 
+# --- MESURES (SPANS) ---
+_trace_local = threading.local()
+
+class Trace:
+    """Durée et nombre d'appels réseau (RPC) par étape d'un import.
+
+    Les spans imbriqués sont permis ; un RPC est compté dans chaque span ouvert.
+    `observer(étape, hôte, secondes, rpc)` est appelé à la fin de chaque span.
+    """
+
+    def __init__(self, host=None, observer=None):
+        self.host = host
+        self.observer = observer
+        self.spans = {}
+        self._stack = []
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def span(self, name):
+        entry = {"rpc": 0}
+        self._stack.append(entry)
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            self._stack = [e for e in self._stack if e is not entry]
+            with self._lock:
+                st = self.spans.setdefault(name, {"ms": 0.0, "calls": 0, "rpc": 0})
+                st["ms"] += elapsed * 1000
+                st["calls"] += 1
+                st["rpc"] += entry["rpc"]
+            if self.observer: self.observer(name, self.host, elapsed, entry["rpc"])
+
+    def count_rpc(self, n=1):
+        for entry in self._stack: entry["rpc"] += n
+
+    def as_dict(self):
+        with self._lock:
+            return {k: {"ms": round(v["ms"], 1), "calls": v["calls"], "rpc": v["rpc"]} for k, v in self.spans.items()}
+
+def current_trace():
+    return getattr(_trace_local, "trace", None)
+
+@contextmanager
+def use_trace(trace):
+    """Rend `trace` courant pour le thread (les spans et RPC du bloc y sont rattachés)."""
+    previous = current_trace()
+    _trace_local.trace = trace
+    try:
+        yield trace
+    finally:
+        _trace_local.trace = previous
+
+@contextmanager
+def span(name):
+    trace = current_trace()
+    if not trace:
+        yield
+        return
+    with trace.span(name):
+        yield
+
+def count_rpc(n=1):
+    trace = current_trace()
+    if trace: trace.count_rpc(n)
+
+# --- MÉTRIQUES PROMETHEUS ---
+METRIC_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+class StageMetrics:
+    """Histogrammes de latence et compteurs RPC par étape et par hôte (format texte Prometheus)."""
+
+    def __init__(self, buckets=METRIC_BUCKETS):
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, stage, host, seconds, rpc):
+        key = (stage, host or "")
+        with self._lock:
+            st = self._series.setdefault(key, {"buckets": [0] * len(self.buckets), "sum": 0.0, "count": 0, "rpc": 0})
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound: st["buckets"][i] += 1
+            st["sum"] += seconds
+            st["count"] += 1
+            st["rpc"] += rpc
+
+    def render(self):
+        lines = ["# HELP payflow_stage_duration_seconds Durée des étapes d'import.",
+                 "# TYPE payflow_stage_duration_seconds histogram"]
+        rpc_lines = ["# HELP payflow_stage_rpc_total Appels réseau (Silae HTTP, Odoo XML-RPC) par étape.",
+                     "# TYPE payflow_stage_rpc_total counter"]
+        with self._lock:
+            for (stage, host), st in sorted(self._series.items()):
+                labels = f'stage="{stage}",host="{host}"'
+                for bound, n in zip(self.buckets, st["buckets"]):
+                    lines.append(f'payflow_stage_duration_seconds_bucket{{{labels},le="{bound}"}} {n}')
+                lines.append(f'payflow_stage_duration_seconds_bucket{{{labels},le="+Inf"}} {st["count"]}')
+                lines.append(f'payflow_stage_duration_seconds_sum{{{labels}}} {st["sum"]:.6f}')
+                lines.append(f'payflow_stage_duration_seconds_count{{{labels}}} {st["count"]}')
+                rpc_lines.append(f'payflow_stage_rpc_total{{{labels}}} {st["rpc"]}')
+        return "\n".join(lines + rpc_lines) + "\n"
+
+stage_metrics = StageMetrics()
+
+# --- CONNEXIONS HTTP / XML-RPC ---
+SILAE_STREAMING = os.environ.get("PAYFLOW_SILAE_STREAMING", "0") == "1" and ijson is not None
+TRACE_MEMORY = os.environ.get("PAYFLOW_TRACE_MEMORY", "0") == "1"
+
+HTTP_TIMEOUT = (int(os.environ.get("PAYFLOW_HTTP_CONNECT_TIMEOUT", "10")), int(os.environ.get("PAYFLOW_HTTP_READ_TIMEOUT", "120")))
+HTTP_POOL_SIZE = int(os.environ.get("PAYFLOW_HTTP_POOL_SIZE", "10"))
+ODOO_TIMEOUT = int(os.environ.get("PAYFLOW_ODOO_TIMEOUT", "120"))
+ODOO_POOL_SIZE = int(os.environ.get("PAYFLOW_ODOO_POOL_SIZE", "4"))
+# Points d'accès Silae (surchargés pour les bancs d'essai locaux, cf. benchmarks/)
+SILAE_AUTH_URL = os.environ.get("PAYFLOW_SILAE_AUTH_URL", "https://payroll-api-auth.silae.fr/oauth2/v2.0/token")
+SILAE_API_URL = os.environ.get("PAYFLOW_SILAE_API_URL", "https://payroll-api.silae.fr").rstrip("/")
+
+def build_http_session():
+    """Session requests partagée (keep-alive) pour les appels Silae."""
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+http_session = build_http_session()
+
+def http_post(url, **kwargs):
+    count_rpc()
+    kwargs.setdefault("timeout", HTTP_TIMEOUT)
+    return http_session.post(url, **kwargs)
+
+class KeepAliveTransport(xmlrpc.client.SafeTransport):
+    """Transport XML-RPC HTTPS qui garde sa connexion ouverte d'un appel à l'autre (HTTP/1.1)."""
+
+    def __init__(self, pool, timeout=ODOO_TIMEOUT):
+        super().__init__()
+        self.pool = pool
+        self.timeout = timeout
+
+    def make_connection(self, host):
+        if not (self._connection[1] and self._connection[0] == host):
+            self.pool.record(host, connections=1)
+        conn = super().make_connection(host)
+        conn.timeout = self.timeout
+        return conn
+
+    def request(self, host, handler, request_body, verbose=False):
+        self.pool.record(host, requests=1)
+        return super().request(host, handler, request_body, verbose)
+
+class OdooTransportPool:
+    """Connexions XML-RPC ouvertes, conservées par hôte Odoo (au plus `size` inactives par hôte)."""
+
+    def __init__(self, size=ODOO_POOL_SIZE):
+        self.size = size
+        self._idle = {}
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, host):
+        with self._lock:
+            idle = self._idle.get(host)
+            if idle: return idle.pop()
+        return KeepAliveTransport(self)
+
+    def release(self, host, transport):
+        with self._lock:
+            idle = self._idle.setdefault(host, [])
+            if len(idle) < self.size:
+                idle.append(transport)
+                return
+        transport.close()
+
+    def record(self, host, requests=0, connections=0):
+        with self._lock:
+            st = self._stats.setdefault(host, {"requests": 0, "connections": 0})
+            st["requests"] += requests
+            st["connections"] += connections
+
+    def stats(self):
+        with self._lock:
+            return {h: dict(st, idle=len(self._idle.get(h, []))) for h, st in self._stats.items()}
+
+class PooledTransport(xmlrpc.client.Transport):
+    """Transport donné au ServerProxy : emprunte une connexion du pool le temps d'un appel."""
+
+    def __init__(self, pool):
+        super().__init__()
+        self.pool = pool
+
+    def request(self, host, handler, request_body, verbose=False):
+        count_rpc()
+        transport = self.pool.acquire(host)
+        try:
+            return transport.request(host, handler, request_body, verbose)
+        finally:
+            self.pool.release(host, transport)
+
+odoo_transports = OdooTransportPool()
+
+def odoo_proxy(url):
+    return xmlrpc.client.ServerProxy(url, transport=PooledTransport(odoo_transports))
+
+def connection_stats():
+    """Statistiques de réutilisation des connexions (Silae via requests, Odoo via XML-RPC)."""
+    silae = {"requests": 0, "connections": 0}
+    pools = http_session.get_adapter("https://").poolmanager.pools
+    for key in pools.keys():
+        pool = pools[key]
+        silae["requests"] += pool.num_requests
+        silae["connections"] += pool.num_connections
+    return {"silae": silae, "odoo": odoo_transports.stats()}
+
+# --- SESSIONS ODOO ---
+ODOO_SESSION_MAX = int(os.environ.get("PAYFLOW_ODOO_SESSION_MAX", "256"))
+
+def is_access_denied(fault):
+    # Odoo renvoie faultCode 3 (AccessDenied) quand l'uid/mot de passe n'est plus accepté
+    return fault.faultCode == 3 or "AccessDenied" in str(fault.faultString) or "Access Denied" in str(fault.faultString)
+
+class OdooSession:
+    """Connexion à une base Odoo : l'uid est obtenu une fois puis réutilisé.
+
+    Une nouvelle authentification n'a lieu que si un appel est refusé (AccessDenied).
+    """
+
+    def __init__(self, host, database, login, password):
+        self.host = host
+        self.database = database
+        self.login = login
+        self.password = password
+        self.uid = None
+        self.common = odoo_proxy(f"https://{host}/xmlrpc/2/common")
+        self.models = odoo_proxy(f"https://{host}/xmlrpc/2/object")
+        self._lock = threading.Lock()
+
+    def authenticate(self, force=False):
+        with self._lock:
+            if force or not self.uid:
+                with span("odoo_authenticate"):
+                    self.uid = self.common.authenticate(self.database, self.login, self.password, {}) or None
+            return self.uid
+
+    def execute_kw(self, model, method, args, kw=None):
+        uid = self.authenticate()
+        if not uid: raise Exception("Auth Odoo échouée")
+        try:
+            return self.models.execute_kw(self.database, uid, self.password, model, method, args, kw or {})
+        except xmlrpc.client.Fault as e:
+            if not is_access_denied(e): raise
+            # Session refusée (mot de passe changé, utilisateur réactivé...) : on se réauthentifie une fois
+            uid = self.authenticate(force=True)
+            if not uid: raise
+            return self.models.execute_kw(self.database, uid, self.password, model, method, args, kw or {})
+
+class OdooSessionPool:
+    """Sessions Odoo partagées, par (hôte, base, login, empreinte du mot de passe)."""
+
+    def __init__(self, max_sessions=ODOO_SESSION_MAX):
+        self.max_sessions = max_sessions
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, host, database, login, password):
+        key = (host, database, login, hashlib.sha256((password or "").encode()).hexdigest())
+        with self._lock:
+            session = self._sessions.get(key)
+            if session:
+                self._sessions.move_to_end(key)
+                return session
+            session = self._sessions[key] = OdooSession(host, database, login, password)
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+            return session
+
+    def for_client(self, conf):
+        return self.get(conf.get('odoo_host'), conf.get('database_odoo'), conf.get('odoo_login'), conf.get('odoo_password'))
+
+odoo_sessions = OdooSessionPool()
+
+# --- CACHE PLAN COMPTABLE ODOO ---
+ODOO_CACHE_TTL = int(os.environ.get("PAYFLOW_ODOO_CACHE_TTL", "3600"))
+ODOO_CACHE_MAX_BYTES = int(os.environ.get("PAYFLOW_ODOO_CACHE_MAX_BYTES", str(8 * 1024 * 1024)))
+
+class OdooChartCache:
+    """Cache LRU par base Odoo (host, base, société) : comptes, journaux et style de domaine Odoo 18+.
+
+    Les entrées expirent après `ttl` secondes ; au-delà de `max_bytes` (taille estimée),
+    les entrées les moins récemment utilisées sont évincées.
+    """
+
+    def __init__(self, ttl=ODOO_CACHE_TTL, max_bytes=ODOO_CACHE_MAX_BYTES):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(conf):
+        return (conf.get('odoo_host'), conf.get('database_odoo'), conf.get('odoo_company_id'))
+
+    @staticmethod
+    def _estimate(entry):
+        # Estimation grossière : surcoût d'un item de dict + longueur de la clé
+        return 256 + sum(72 + len(str(k)) for k in entry['accounts']) + sum(72 + len(str(k)) for k in entry['journals'])
+
+    def _drop(self, key):
+        entry = self._entries.pop(key, None)
+        if entry: self._size -= entry['size']
+
+    def get(self, key):
+        """Retourne une copie de l'entrée (comptes, journaux, odoo18) ou une entrée vide."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry['expires'] < time.monotonic():
+                self._drop(key)
+                entry = None
+            if not entry:
+                return {'accounts': {}, 'journals': {}, 'odoo18': None}
+            self._entries.move_to_end(key)
+            return {'accounts': dict(entry['accounts']), 'journals': dict(entry['journals']), 'odoo18': entry['odoo18']}
+
+    def update(self, key, accounts=None, journals=None, odoo18=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if not entry or entry['expires'] < time.monotonic():
+                self._drop(key)
+                entry = {'accounts': {}, 'journals': {}, 'odoo18': None, 'size': 0, 'expires': time.monotonic() + self.ttl}
+            else:
+                self._drop(key)
+            if accounts: entry['accounts'].update(accounts)
+            if journals: entry['journals'].update(journals)
+            if odoo18 is not None: entry['odoo18'] = odoo18
+            entry['size'] = self._estimate(entry)
+            self._entries[key] = entry
+            self._size += entry['size']
+            while self._size > self.max_bytes and len(self._entries) > 1:
+                self._drop(next(iter(self._entries)))
+
+    def invalidate(self, host=None, database=None, company_id=None):
+        """Supprime les entrées correspondant aux critères fournis (aucun critère = tout vider)."""
+        with self._lock:
+            for k in [k for k in self._entries if (host is None or k[0] == host) and (database is None or k[1] == database) and (company_id is None or k[2] == company_id)]:
+                self._drop(k)
+
+odoo_chart_cache = OdooChartCache()
+
 # --- LOGIQUE MÉTIER ---
 
 def get_silae_config():
     return {k: get_secret(f"SILAE_{k.upper()}") for k in ["client_id", "client_secret", "subscription_key"]}
 
-def get_silae_token_manual(config):
-    auth_url = "https://payroll-api-auth.silae.fr/oauth2/v2.0/token"
+def fetch_silae_token(config):
+    auth_url = SILAE_AUTH_URL
     data = {"grant_type": "client_credentials", "client_id": config['client_id'], "client_secret": config['client_secret'], "scope": "https://silaecloudb2c.onmicrosoft.com/36658aca-9556-41b7-9e48-77e90b006f34/.default"}
-    r = requests.post(auth_url, data=data)
-    r.raise_for_status()
-    return r.json()["access_token"]
+    with span("silae_token"):
+        r = http_post(auth_url, data=data)
+        r.raise_for_status()
+        payload = r.json()
+    return payload["access_token"], payload.get("expires_in", 3600)
 
-def get_silae_ecritures_manual(token, config, dossier, start, end):
-    url = "https://payroll-api.silae.fr/payroll/v1/EcrituresComptables/EcrituresComptables4"
-    headers = {"Authorization": f"Bearer {token}", "Ocp-Apim-Subscription-Key": config['subscription_key'], "Content-Type": "application/json", "dossiers": str(dossier)}
+class SilaeTokenProvider:
+    """Jeton OAuth2 Silae partagé par tout le processus.
+
+    Le jeton est conservé jusqu'à `margin` secondes avant son `expires_in` ; un seul
+    thread le renouvelle à la fois, les autres attendent et réutilisent le résultat.
+    """
+
+    def __init__(self, margin=60):
+        self.margin = margin
+        self._tokens = {}
+        self._lock = threading.Lock()
+
+    def get(self, config):
+        with self._lock:
+            cached = self._tokens.get(config['client_id'])
+            if cached and cached[1] > time.monotonic():
+                return cached[0]
+            token, expires_in = fetch_silae_token(config)
+            self._tokens[config['client_id']] = (token, time.monotonic() + max(int(expires_in) - self.margin, 0))
+            return token
+
+    def invalidate(self, token=None):
+        """Oublie le jeton (refusé par Silae). Avec `token`, seul ce jeton précis est oublié."""
+        with self._lock:
+            for k, (t, _) in list(self._tokens.items()):
+                if token is None or t == token: del self._tokens[k]
+
+silae_tokens = SilaeTokenProvider()
+
+def get_silae_token_manual(config):
+    return silae_tokens.get(config)
+
+def post_silae_ecritures(token, config, dossier, start, end, stream=False):
+    url = f"{SILAE_API_URL}/payroll/v1/EcrituresComptables/EcrituresComptables4"
     body = {"numeroDossier": str(dossier), "periodeDebut": start.strftime("%Y-%m-%d"), "periodeFin": end.strftime("%Y-%m-%d"), "avecToutesLesRepartitionsAnalytiques": False}
-    r = requests.post(url, headers=headers, json=body)
+    for attempt in range(2):
+        headers = {"Authorization": f"Bearer {token}", "Ocp-Apim-Subscription-Key": config['subscription_key'], "Content-Type": "application/json", "dossiers": str(dossier)}
+        r = http_post(url, headers=headers, json=body, stream=stream)
+        if r.status_code != 401 or attempt: break
+        # Jeton expiré ou révoqué côté Silae : on le renouvelle une fois
+        r.close()
+        silae_tokens.invalidate(token)
+        token = silae_tokens.get(config)
     r.raise_for_status()
-    return r.json()
+    return r
 
-def import_to_odoo_logic(client_conf, ecritures, period_str, entry_date):
+def get_silae_ecritures_manual(token, config, dossier, start, end):
+    with span("silae_ecritures"):
+        return post_silae_ecritures(token, config, dossier, start, end).json()
+
+def stream_silae_ecritures_manual(token, config, dossier, start, end):
+    """Envoie la requête tout de suite (erreurs Silae levées ici) et retourne le flux des lignes.
+
+    La réponse est lue au fil de l'eau par l'étape suivante, sans charger tout le JSON.
+    """
+    # Seule l'attente des en-têtes est mesurée : le corps est lu par l'étape suivante
+    with span("silae_ecritures"):
+        r = post_silae_ecritures(token, config, dossier, start, end, stream=True)
+    r.raw.decode_content = True
+    return iter_streamed_lines(r)
+
+def iter_streamed_lines(r):
     try:
-        # 1. Connexion
-        url_common = f"https://{client_conf['odoo_host']}/xmlrpc/2/common"
-        url_object = f"https://{client_conf['odoo_host']}/xmlrpc/2/object"
-        db = client_conf['database_odoo']
-        user = client_conf['odoo_login']
-        pwd = client_conf['odoo_password']
-        company_id = client_conf['odoo_company_id']
+        yield from ijson.items(r.raw, 'ruptures.item.ecritures.item', use_float=True)
+    finally:
+        r.close()
 
-        common = xmlrpc.client.ServerProxy(url_common)
-        uid = common.authenticate(db, user, pwd, {})
-        if not uid: return "ERROR_AUTH", "Auth Odoo échouée"
-        
-        models = xmlrpc.client.ServerProxy(url_object)
-        
-        # 2. Données Silae (CORRECTIF PROVISIONS & NONETYPE)
-        if not ecritures.get('ruptures'): return "SUCCESS_EMPTY", "Aucune donnée"
-        
-        lignes = []
-        for rupture in ecritures['ruptures']:
-            # Utilisation de 'or []' pour éviter l'erreur NoneType is not iterable
-            lignes.extend(rupture.get('ecritures') or [])
+def fetch_silae_ecritures(token, config, dossier, start, end):
+    # Flux de lignes si PAYFLOW_SILAE_STREAMING=1 (et ijson installé), sinon réponse complète
+    fetch = stream_silae_ecritures_manual if SILAE_STREAMING else get_silae_ecritures_manual
+    return fetch(token, config, dossier, start, end)
 
-        if not lignes: return "SUCCESS_EMPTY", "Journal vide"
-        
-        # 3. Journal
-        j_ids = models.execute_kw(db, uid, pwd, 'account.journal', 'search', [[('code', '=', client_conf['journal_paie_odoo'])]])
-        if not j_ids: return "ERROR_JOURNAL", f"Journal introuvable"
-        journal_id = j_ids[0]
-        
-        # 4. Lignes (CORRECTIF ODOO 18)
-        move_lines = []
-        for l in lignes:
+def iter_silae_lines(ecritures):
+    # CORRECTIF PROVISIONS & NONETYPE : toutes les ruptures, 'or []' si une rupture est vide/null
+    for rupture in ecritures.get('ruptures') or []:
+        yield from rupture.get('ecritures') or []
+
+def read_silae_lines(ecritures):
+    """Lignes (compte, libellé, débit, crédit) depuis la réponse complète (dict) ou un flux de lignes."""
+    lines = iter_silae_lines(ecritures) if isinstance(ecritures, dict) else ecritures
+    return [(l['compte'], l['libelle'], l['valeur'] if l['sens'] == 'D' else 0.0, l['valeur'] if l['sens'] == 'C' else 0.0) for l in lines]
+
+# tracemalloc est global au processus : un seul bloc mesuré à la fois
+_memory_lock = threading.Lock()
+
+@contextmanager
+def memory_peak(label):
+    """Affiche le pic mémoire Python du bloc (PAYFLOW_TRACE_MEMORY=1, imports mesurés un par un)."""
+    if not TRACE_MEMORY:
+        yield
+        return
+    with _memory_lock:
+        # Traçage déjà lancé par ailleurs (banc d'essai) : on le laisse actif en sortant
+        started = not tracemalloc.is_tracing()
+        if started: tracemalloc.start()
+        tracemalloc.reset_peak()
+        try:
+            yield
+        finally:
+            peak = tracemalloc.get_traced_memory()[1]
+            if started: tracemalloc.stop()
+            print(f"[mémoire] {label} ({'flux' if SILAE_STREAMING else 'complet'}): pic {peak / 1024 / 1024:.1f} Mo")
+
+def resolve_account_ids(session, codes, company_id, cache_key=None):
+    """Résout tous les codes comptables en un seul search_read. Retourne {code: id}.
+
+    Avec `cache_key`, seuls les codes absents du cache sont demandés à Odoo.
+    """
+    chart = odoo_chart_cache.get(cache_key) if cache_key else {'accounts': {}, 'odoo18': None}
+    known = chart['accounts']
+    todo = sorted({c for c in codes if c not in known})
+    if todo:
+        odoo18 = chart['odoo18']
+        fields = {'fields': ['code']}
+        ctx = {'allowed_company_ids': [company_id], 'check_company': True}
+        if odoo18:
+            accounts = session.execute_kw('account.account', 'search_read', [[('code', 'in', todo)]], dict(fields, context=ctx))
+        else:
             # On tente d'abord avec company_id (Odoo 17 et moins)
-            acc_domain = [('code', '=', l['compte']), ('company_id', '=', company_id)]
-            
+            acc_domain = [('code', 'in', todo), ('company_id', '=', company_id)]
             try:
-                acc_ids = models.execute_kw(db, uid, pwd, 'account.account', 'search', [acc_domain])
+                accounts = session.execute_kw('account.account', 'search_read', [acc_domain], fields)
+                odoo18 = False
             except xmlrpc.client.Fault as e:
                 # Si erreur "KeyError: company_id", on est sur Odoo 18+
-                if "company_id" in str(e):
-                    # Recherche par code uniquement, avec contexte société
-                    acc_domain = [('code', '=', l['compte'])]
-                    ctx = {'allowed_company_ids': [company_id], 'check_company': True}
-                    acc_ids = models.execute_kw(db, uid, pwd, 'account.account', 'search', [acc_domain], {'context': ctx})
-                else:
-                    raise e
-
-            if not acc_ids: return "ERROR_ACCOUNT", f"Compte {l['compte']} introuvable"
-            
-            move_lines.append((0, 0, {
-                'account_id': acc_ids[0],
-                'name': l['libelle'],
-                'debit': l['valeur'] if l['sens'] == 'D' else 0.0,
-                'credit': l['valeur'] if l['sens'] == 'C' else 0.0
-            }))
+                if "company_id" not in str(e): raise
+                # Recherche par code uniquement, avec contexte société
+                accounts = session.execute_kw('account.account', 'search_read', [[('code', 'in', todo)]], dict(fields, context=ctx))
+                odoo18 = True
+
+        fetched = {}
+        for acc in accounts:
+            # On garde le premier résultat par code, comme l'ancien search()[0]
+            fetched.setdefault(acc['code'], acc['id'])
+        known.update(fetched)
+        if cache_key: odoo_chart_cache.update(cache_key, accounts=fetched, odoo18=odoo18)
+    return {c: known[c] for c in codes if c in known}
+
+# --- REGISTRE DES IMPORTS ---
+def lines_hash(lignes, conf):
+    """Empreinte des lignes Silae normalisées (ordre ignoré) et de la destination Odoo."""
+    normalized = sorted((code, name, round(float(debit), 2), round(float(credit), 2)) for code, name, debit, credit in lignes)
+    target = [conf.get('odoo_host'), conf.get('database_odoo'), conf.get('odoo_company_id'), conf.get('journal_paie_odoo')]
+    return hashlib.sha256(json.dumps([target, normalized], ensure_ascii=False).encode()).hexdigest()
+
+def ledger_get(doc_id, period):
+    if not db or not doc_id: return None
+    snap = db.collection("payflow_ledger").document(f"{doc_id}_{period}").get()
+    return snap.to_dict() if snap.exists else None
+
+def ledger_put(doc_id, period, digest, move_id, line_count):
+    if not db or not doc_id: return
+    try:
+        db.collection("payflow_ledger").document(f"{doc_id}_{period}").set({
+            "client_doc_id": doc_id, "period": period, "hash": digest, "move_id": move_id,
+            "lines": line_count, "imported_at": datetime.utcnow()
+        })
+    except Exception as e:
+        # La pièce est créée : on ne transforme pas le succès en erreur
+        print(f"Erreur registre {doc_id}_{period}: {e}")
+
+def import_to_odoo_logic(client_conf, ecritures, period_str, entry_date, doc_id=None, force=False):
+    try:
+        # 1. Données Silae (réponse complète ou flux de lignes)
+        if isinstance(ecritures, dict) and not ecritures.get('ruptures'): return "SUCCESS_EMPTY", "Aucune donnée"
+        lignes = read_silae_lines(ecritures)
+
+        if not lignes: return "SUCCESS_EMPTY", "Journal vide"
+
+        # 2. Registre : période déjà importée avec les mêmes données -> rien à faire côté Odoo
+        digest = lines_hash(lignes, client_conf)
+        previous = ledger_get(doc_id, period_str)
+        if previous and previous.get('hash') == digest and not force:
+            return "SUCCESS_UNCHANGED", f"Déjà importé (pièce ID {previous.get('move_id')}), données Silae inchangées"
+
+        # Connexion (session partagée, uid en cache)
+        company_id = client_conf['odoo_company_id']
+        session = odoo_sessions.for_client(client_conf)
+        if not session.authenticate(): return "ERROR_AUTH", "Auth Odoo échouée"
+        
+        # 3. Journal
+        cache_key = OdooChartCache.key(client_conf)
+        journal_code = client_conf['journal_paie_odoo']
+        journal_id = odoo_chart_cache.get(cache_key)['journals'].get(journal_code)
+        if not journal_id:
+            with span("odoo_journal"):
+                j_ids = session.execute_kw('account.journal', 'search', [[('code', '=', journal_code)]])
+            if not j_ids: return "ERROR_JOURNAL", f"Journal introuvable"
+            journal_id = j_ids[0]
+            odoo_chart_cache.update(cache_key, journals={journal_code: journal_id})
+        
+        # 4. Comptes (résolution groupée, une seule requête, cache par base)
+        with span("odoo_accounts"):
+            acc_map = resolve_account_ids(session, [l[0] for l in lignes], company_id, cache_key)
+        missing = sorted({l[0] for l in lignes if l[0] not in acc_map})
+        if missing: return "ERROR_ACCOUNT", f"Compte(s) {', '.join(missing)} introuvable(s)"
+
+        # 5. Lignes
+        line_count = len(lignes)
+        move_lines = [(0, 0, {'account_id': acc_map[code], 'name': name, 'debit': debit, 'credit': credit}) for code, name, debit, credit in lignes]
+        del lignes
             
-        # 5. Libellé Personnalisé (SALAIRES MOIS ANNEE)
+        # 6. Libellé Personnalisé (SALAIRES MOIS ANNEE)
         try:
             y, m = period_str.split('-')
             months = ["", "JANVIER", "FEVRIER", "MARS", "AVRIL", "MAI", "JUIN", "JUILLET", "AOUT", "SEPTEMBRE", "OCTOBRE", "NOVEMBRE", "DECEMBRE"]
@@ -165,7 +870,7 @@ def import_to_odoo_logic(client_conf, ecritures, period_str, entry_date):
         except:
             label_ref = f"SALAIRES {period_str}"
 
-        # 6. Pièce
+        # 7. Pièce
         move_vals = {
             'journal_id': journal_id,
             'ref': label_ref,
@@ -173,118 +878,623 @@ def import_to_odoo_logic(client_conf, ecritures, period_str, entry_date):
             'line_ids': move_lines,
             'company_id': company_id
         }
-        move_id = models.execute_kw(db, uid, pwd, 'account.move', 'create', [move_vals])
+        with span("odoo_create"):
+            move_id = session.execute_kw('account.move', 'create', [move_vals])
+        ledger_put(doc_id, period_str, digest, move_id, line_count)
+        if previous:
+            reason = "réimport forcé" if previous.get('hash') == digest else "données modifiées"
+            return "SUCCESS", f"Pièce créée ID {move_id} ({label_ref}), {reason} depuis la pièce ID {previous.get('move_id')}"
         return "SUCCESS", f"Pièce créée ID {move_id} ({label_ref})"
 
     except Exception as e:
+        # Un id en cache peut être obsolète (compte/journal supprimé) : on repart de zéro
+        odoo_chart_cache.invalidate(client_conf.get('odoo_host'), client_conf.get('database_odoo'), client_conf.get('odoo_company_id'))
         return "ERROR_ODOO", str(e)
 
-def log_db(doc_id, name, period, status, msg):
+# --- JOURNAL FIRESTORE BUFFERISÉ ---
+LOG_FLUSH_SIZE = int(os.environ.get("PAYFLOW_LOG_FLUSH_SIZE", "50"))
+LOG_FLUSH_INTERVAL = float(os.environ.get("PAYFLOW_LOG_FLUSH_INTERVAL", "5"))
+LOG_PENDING_MAX = int(os.environ.get("PAYFLOW_LOG_PENDING_MAX", "5000"))
+
+def merge_update(previous, data):
+    """Fusionne deux écritures `merge=True` d'un même document (Increment, ArrayUnion, sous-dictionnaires)."""
+    from google.cloud import firestore
+    out = dict(previous)
+    for key, value in data.items():
+        prev = out.get(key)
+        if isinstance(value, firestore.Increment) and isinstance(prev, firestore.Increment):
+            out[key] = firestore.Increment(prev.value + value.value)
+        elif isinstance(value, firestore.ArrayUnion) and isinstance(prev, firestore.ArrayUnion):
+            out[key] = firestore.ArrayUnion(list(prev.values) + [v for v in value.values if v not in prev.values])
+        elif isinstance(value, dict) and isinstance(prev, dict):
+            out[key] = merge_update(prev, value)
+        else:
+            out[key] = value
+    return out
+
+class LogBuffer:
+    """Tampon des écritures de journal, envoyées par lots Firestore (WriteBatch).
+
+    Le lot part dès `max_size` entrées ou toutes les `interval` secondes ; en cas d'échec
+    les entrées sont remises en tête du tampon et renvoyées au flush suivant. Au-delà de
+    `max_pending` entrées en attente (Firestore indisponible), les plus anciennes sont abandonnées.
+    """
+
+    def __init__(self, client, collection, max_size=LOG_FLUSH_SIZE, interval=LOG_FLUSH_INTERVAL, max_pending=LOG_PENDING_MAX):
+        self.client = client
+        self.collection = collection
+        self.max_size = min(max_size, 500)  # limite Firestore par lot
+        self.interval = interval
+        self.max_pending = max(max_pending, self.max_size)
+        self._pending = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._timer = None
+
+    @staticmethod
+    def new_id(*parts):
+        # Microsecondes + suffixe aléatoire : deux entrées de la même seconde ne s'écrasent plus
+        return "_".join([*map(str, parts), datetime.now().strftime('%Y%m%dT%H%M%S%f'), uuid.uuid4().hex[:8]])
+
+    def add(self, doc_id, data, collection=None, merge=False):
+        with self._lock:
+            self._pending.append((collection or self.collection, doc_id, data, merge))
+            full = len(self._pending) >= self.max_size
+            if not self._timer:
+                self._timer = threading.Thread(target=self._run_timer, daemon=True)
+                self._timer.start()
+        if full: self.flush()
+
+    @staticmethod
+    def coalesce(entries):
+        """Une seule écriture par document et par lot : les `merge=True` successifs sont fusionnés."""
+        out, index = [], {}
+        for collection, doc_id, data, merge in entries:
+            key = (collection, doc_id)
+            if merge and key in index:
+                i = index[key]
+                out[i] = (collection, doc_id, merge_update(out[i][2], data), merge)
+                continue
+            if merge: index[key] = len(out)
+            else: index.pop(key, None)
+            out.append((collection, doc_id, data, merge))
+        return out
+
+    def _run_timer(self):
+        while True:
+            time.sleep(self.interval)
+            self.flush()
+
+    def flush(self, retries=0):
+        """Envoie le tampon. Avec `retries`, réessaie (backoff) avant de rendre la main."""
+        for attempt in range(retries + 1):
+            with self._flush_lock:
+                with self._lock:
+                    entries, self._pending = self._pending, []
+                if not entries: return True
+                entries = self.coalesce(entries)
+                try:
+                    while entries:
+                        chunk = entries[:self.max_size]
+                        batch = self.client.batch()
+                        for collection, doc_id, data, merge in chunk:
+                            batch.set(self.client.collection(collection).document(doc_id), data, merge=merge)
+                        batch.commit()
+                        entries = entries[len(chunk):]
+                    return True
+                except Exception as e:
+                    print(f"Erreur écriture journal ({len(entries)} entrée(s) conservée(s)): {e}")
+                    with self._lock:
+                        self._pending = entries + self._pending
+                        dropped = len(self._pending) - self.max_pending
+                        if dropped > 0: del self._pending[:dropped]
+                    if dropped > 0: print(f"Tampon de journal plein : {dropped} entrée(s) les plus anciennes abandonnées")
+            if attempt < retries: time.sleep(min(2 ** attempt, 10))
+        return False
+
+def client_stats_update(name, period, status, msg, now):
+    """Compteurs agrégés par client (payflow_client_stats), mis à jour avec chaque entrée de journal."""
+    from google.cloud import firestore
+    update = {
+        "client_name": name, "last_status": status, "last_period": period,
+        "last_execution_time": now, "last_message": str(msg)[:300], "runs": firestore.Increment(1),
+        "periods": {period: {"last_status": status, "last_execution_time": now}}
+    }
+    if "SUCCESS" in status:
+        update["last_success_time"] = now
+        update["periods"][period]["last_success_time"] = now
+    elif "ERROR" in status or "CRASH" in status:
+        update["errors"] = firestore.Increment(1)
+    return update
+
+log_buffer = LogBuffer(db, "payflow_logs")
+
+def log_db(doc_id, name, period, status, msg, timings=None):
     if db:
-        log_id = f"{doc_id}_{period}_{datetime.now().strftime('%Y%m%dT%H%M%S')}"
-        db.collection("payflow_logs").document(log_id).set({
+        now = datetime.utcnow()
+        log_buffer.add(LogBuffer.new_id(doc_id, period), {
             "client_doc_id": doc_id, "client_name": name, "period": period,
-            "execution_time": datetime.utcnow(), "status": status, "message": str(msg)[:1500]
+            "execution_time": now, "status": status, "message": str(msg)[:1500], "timings": timings or {}
         })
+        log_buffer.add(doc_id, client_stats_update(name, period, status, msg, now), collection="payflow_client_stats", merge=True)
+
+# --- JOBS D'IMPORT ASYNCHRONES ---
+JOB_WORKERS = int(os.environ.get("PAYFLOW_JOB_WORKERS", "4"))
+JOB_HEARTBEAT = 30
+JOB_STALE_AFTER = int(os.environ.get("PAYFLOW_JOB_STALE_AFTER", "180"))
+job_pool = ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix="payflow-job")
+
+def start_import_job(client_doc_id, client_data, silae_conf, periods, force=False):
+    """Enregistre le job dans Firestore (payflow_jobs) et lance ses périodes sur le pool."""
+    from google.cloud import firestore
+    from google.cloud.firestore_v1.field_path import FieldPath
+    periods = list(dict.fromkeys(periods))
+    job_id = uuid.uuid4().hex
+    ref = db.collection("payflow_jobs").document(job_id)
+    ref.set({
+        "job_id": job_id, "client_doc_id": client_doc_id, "client_name": client_data.get('nom'),
+        "status": "RUNNING" if periods else "DONE", "total": len(periods), "done": 0, "errors": 0,
+        "periods": {p: {"status": "pending", "message": ""} for p in periods},
+        "created_at": datetime.utcnow(), "updated_at": datetime.utcnow()
+    })
+    remaining = {"count": len(periods)}
+    lock = threading.Lock()
+    finished_event = threading.Event()
+
+    def update_job(data):
+        try:
+            ref.update(data)
+        except Exception as e:
+            print(f"Erreur mise à jour job {job_id}: {e}")
+
+    def heartbeat():
+        # `updated_at` rafraîchi tant que l'instance vit : sans lui, le job est déclaré interrompu
+        while not finished_event.wait(JOB_HEARTBEAT):
+            update_job({"updated_at": datetime.utcnow()})
+
+    def run(period):
+        # Les périodes (« 2026-01 ») contiennent un tiret : chemin de champ Firestore échappé
+        key = FieldPath("periods", period).to_api_repr()
+        try:
+            update_job({key: {"status": "running", "message": ""}, "updated_at": datetime.utcnow()})
+            res = import_manual_period(client_doc_id, client_data, silae_conf, period, force)
+        except Exception as e:
+            # Le pool ne remonte pas les exceptions : la période doit quand même être clôturée
+            print(f"Erreur job {job_id} ({period}): {e}")
+            res = {"period": period, "status": "error", "message": f"Erreur interne: {e}"}
+        with lock:
+            remaining["count"] -= 1
+            finished = remaining["count"] == 0
+        update = {
+            key: {"status": res["status"], "message": res["message"]},
+            "done": firestore.Increment(1), "updated_at": datetime.utcnow()
+        }
+        if res["status"] == "error": update["errors"] = firestore.Increment(1)
+        if finished:
+            finished_event.set()
+            update["status"] = "DONE"
+            log_buffer.flush(retries=3)
+        update_job(update)
+
+    if periods: threading.Thread(target=heartbeat, name=f"payflow-job-{job_id[:8]}", daemon=True).start()
+    # Chaque période est une pièce Odoo indépendante : elles peuvent tourner en parallèle
+    for period in periods:
+        job_pool.submit(run, period)
+    return job_id
+
+# --- IMPORT MANUEL EN FLUX (NDJSON) ---
+STREAM_WORKERS = int(os.environ.get("PAYFLOW_STREAM_WORKERS", "4"))
+STREAM_HEARTBEAT = 15
+
+def stream_manual_import(client_doc_id, client_data, silae_conf, periods, force=False):
+    """Importe les périodes en parallèle et émet une ligne JSON par période, dans l'ordre de fin.
+
+    Une ligne vide est émise toutes les STREAM_HEARTBEAT secondes sans résultat pour garder
+    la connexion ouverte derrière les proxies.
+    """
+    periods = list(dict.fromkeys(periods))
+    if not periods: return
+    with ThreadPoolExecutor(max_workers=min(STREAM_WORKERS, len(periods))) as pool:
+        pending = {pool.submit(import_manual_period, client_doc_id, client_data, silae_conf, p, force) for p in periods}
+        while pending:
+            done, pending = wait(pending, timeout=STREAM_HEARTBEAT, return_when=FIRST_COMPLETED)
+            if not done:
+                yield "\n"
+                continue
+            for fut in done:
+                yield json.dumps(fut.result(), ensure_ascii=False) + "\n"
+    log_buffer.flush(retries=3)
+
+# --- CACHE LISTE CLIENTS ---
+CLIENTS_CACHE_TTL = int(os.environ.get("PAYFLOW_CLIENTS_CACHE_TTL", "300"))
+CLIENTS_LISTEN = os.environ.get("PAYFLOW_CLIENTS_LISTEN", "0") == "1"
+
+def mask_client(d):
+    d = dict(d)
+    d['odoo_password'] = "••••••••" if d.get('odoo_password') else None
+    return d
+
+class ClientListCache:
+    """Liste des clients (mots de passe masqués) gardée en mémoire, avec un ETag de contenu.
+
+    `save_client` met le cache à jour à l'écriture. Sans écoute Firestore, la liste est relue
+    après `ttl` secondes (écritures d'autres instances) ; avec `listen`, les changements
+    arrivent par on_snapshot et la liste n'est jamais relue.
+    """
+
+    def __init__(self, ttl=CLIENTS_CACHE_TTL, listen=CLIENTS_LISTEN):
+        self.ttl = ttl
+        self.listen = listen
+        self._clients = None
+        self._etag = None
+        self._loaded_at = 0.0
+        self._watch = None
+        self._lock = threading.Lock()
+
+    def _set(self, clients):
+        self._clients = clients
+        body = json.dumps(clients, sort_keys=True, default=str).encode()
+        self._etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+        self._loaded_at = time.monotonic()
+
+    def _on_snapshot(self, snapshots, changes, read_time):
+        with self._lock:
+            self._set({doc.id: mask_client(doc.to_dict()) for doc in snapshots})
+
+    def get(self):
+        """Retourne (clients, etag)."""
+        with self._lock:
+            fresh = self._clients is not None and (self._watch or time.monotonic() - self._loaded_at < self.ttl)
+            if fresh: return self._clients, self._etag
+        if not db: return {}, None
+        if self.listen and not self._watch:
+            # Premier snapshot reçu de façon asynchrone : on lit quand même la collection cette fois
+            self._watch = db.collection("payflow_clients").on_snapshot(self._on_snapshot)
+        clients = {doc.id: mask_client(doc.to_dict()) for doc in db.collection("payflow_clients").stream()}
+        with self._lock:
+            self._set(clients)
+            return self._clients, self._etag
+
+    def write(self, doc_id, data):
+        """Écriture directe (merge) après un save_client réussi."""
+        with self._lock:
+            if self._clients is None: return
+            clients = dict(self._clients)
+            merged = dict(clients.get(doc_id) or {})
+            merged.update(mask_client(data) if 'odoo_password' in data else data)
+            clients[doc_id] = merged
+            self._set(clients)
+
+clients_cache = ClientListCache()
 
 # --- ROUTES ---
 @app.post("/api/auth/login")
 def login(request: LoginRequest):
     try:
-        if request.password == get_secret("PAYFLOW_PASSWORD"):
+        if check_password(request.password):
             return {"status": "ok"}
         raise HTTPException(status_code=401)
     except: raise HTTPException(status_code=500)
 
+LOG_FIELDS = ["client_doc_id", "client_name", "period", "execution_time", "status", "message"]
+
 @app.get("/api/logs", dependencies=[Depends(verify_password)])
-def get_logs():
+def get_logs(limit: int = 100, cursor: Optional[str] = None, client_doc_id: Optional[str] = None,
+             status: Optional[str] = None, period: Optional[str] = None, fields: Optional[str] = None):
+    """Journal paginé (plus récent d'abord). `cursor` = `next_cursor` de la page précédente.
+
+    Les filtres s'appuient sur les index composites de firestore.indexes.json.
+    """
     logs = []
+    next_cursor = None
     if db:
-        for doc in db.collection("payflow_logs").order_by("execution_time", direction="DESCENDING").limit(100).stream():
+        limit = max(1, min(limit, 500))
+        query = db.collection("payflow_logs")
+        for field, value in (("client_doc_id", client_doc_id), ("status", status), ("period", period)):
+            if value: query = query.where(field, "==", value)
+        selected = [f for f in fields.split(",") if f] if fields else LOG_FIELDS
+        if "execution_time" not in selected: selected.append("execution_time")
+        query = query.select(selected).order_by("execution_time", direction="DESCENDING")
+        if cursor:
+            last = db.collection("payflow_logs").document(cursor).get()
+            if not last.exists: raise HTTPException(status_code=400, detail="Curseur invalide")
+            query = query.start_after(last)
+        for doc in query.limit(limit).stream():
             d = doc.to_dict()
-            if 'execution_time' in d: d['execution_time'] = d['execution_time'].isoformat()
+            d['id'] = doc.id
+            if d.get('execution_time'): d['execution_time'] = d['execution_time'].isoformat()
             logs.append(d)
-    return logs
+        if len(logs) == limit: next_cursor = logs[-1]['id']
+    return {"logs": logs, "next_cursor": next_cursor}
 
-@app.get("/api/clients", dependencies=[Depends(verify_password)])
-def get_clients():
-    clients = {}
+@app.get("/api/stats/clients", dependencies=[Depends(verify_password)])
+def get_client_stats():
+    """Dernier statut et dernier succès par période, par client (sans parcourir le journal)."""
+    stats = {}
     if db:
-        for doc in db.collection("payflow_clients").stream():
+        for doc in db.collection("payflow_client_stats").stream():
             d = doc.to_dict()
-            d['odoo_password'] = "••••••••" if d.get('odoo_password') else None
-            clients[doc.id] = d
-    return clients
+            for k in ('last_execution_time', 'last_success_time'):
+                if d.get(k): d[k] = d[k].isoformat()
+            for p in (d.get('periods') or {}).values():
+                for k in ('last_execution_time', 'last_success_time'):
+                    if p.get(k): p[k] = p[k].isoformat()
+            stats[doc.id] = d
+    return stats
+
+@app.get("/api/clients", dependencies=[Depends(verify_password)])
+def get_clients(if_none_match: Optional[str] = Header(None)):
+    clients, etag = clients_cache.get()
+    headers = {"Cache-Control": "private, no-cache"}
+    if etag: headers["ETag"] = etag
+    if etag and if_none_match == etag: return Response(status_code=304, headers=headers)
+    return JSONResponse(clients, headers=headers)
 
 @app.post("/api/clients/{doc_id}", dependencies=[Depends(verify_password)])
 def save_client(doc_id: str, client: ClientConfig):
     data = client.dict()
     if client.odoo_password and client.odoo_password != "••••••••":
-        f = Fernet(get_encryption_key())
+        f = get_fernet()
         data['odoo_password'] = f.encrypt(client.odoo_password.encode()).decode()
     else:
         del data['odoo_password']
     if db: db.collection("payflow_clients").document(doc_id).set(data, merge=True)
+    clients_cache.write(doc_id, data)
+    # Paramètres Odoo modifiés : on oublie le plan comptable en cache pour cette base
+    odoo_chart_cache.invalidate(client.odoo_host, client.database_odoo)
+    return {"status": "success"}
+
+@app.post("/api/secrets/refresh", dependencies=[Depends(verify_password)])
+def refresh_secrets():
+    # À appeler après une rotation de secret dans Secret Manager
+    secrets_cache.refresh()
     return {"status": "success"}
 
+@app.get("/api/metrics", dependencies=[Depends(verify_password)])
+def get_metrics():
+    return PlainTextResponse(stage_metrics.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/api/stats/startup", dependencies=[Depends(verify_password)])
+def get_startup_profile():
+    return startup_profile.as_dict()
+
+@app.get("/api/stats/connections", dependencies=[Depends(verify_password)])
+def get_connection_stats():
+    return connection_stats()
+
 @app.post("/api/test-odoo", dependencies=[Depends(verify_password)])
 def test_odoo_connection(config: Dict[str, Any]):
     try:
-        pwd = config.get('odoo_password')
-        url_common = f"https://{config['odoo_host']}/xmlrpc/2/common"
-        url_object = f"https://{config['odoo_host']}/xmlrpc/2/object"
-        
-        common = xmlrpc.client.ServerProxy(url_common)
-        uid = common.authenticate(config['database_odoo'], config['odoo_login'], pwd, {})
+        session = odoo_sessions.get(config['odoo_host'], config['database_odoo'], config['odoo_login'], config.get('odoo_password'))
+        # Test explicite : on force une nouvelle authentification
+        uid = session.authenticate(force=True)
         if not uid: raise HTTPException(status_code=400, detail="Auth échouée")
             
-        models = xmlrpc.client.ServerProxy(url_object)
-        user_data = models.execute_kw(config['database_odoo'], uid, pwd, 'res.users', 'read', [uid], {'fields': ['company_ids']})
+        user_data = session.execute_kw('res.users', 'read', [uid], {'fields': ['company_ids']})
         company_ids = user_data[0]['company_ids']
-        companies = {c['id']: c['name'] for c in models.execute_kw(config['database_odoo'], uid, pwd, 'res.company', 'read', [company_ids], {'fields': ['name']})}
+        companies = {c['id']: c['name'] for c in session.execute_kw('res.company', 'read', [company_ids], {'fields': ['name']})}
         
         # On récupère aussi company_id pour l'affichage
-        journals = models.execute_kw(config['database_odoo'], uid, pwd, 'account.journal', 'search_read', [[('type', 'in', ['bank', 'cash', 'sale', 'purchase', 'general'])]], {'fields': ['name', 'code', 'company_id']})
+        journals = session.execute_kw('account.journal', 'search_read', [[('type', 'in', ['bank', 'cash', 'sale', 'purchase', 'general'])]], {'fields': ['name', 'code', 'company_id']})
         
         return {"status": "success", "companies": companies, "journals": journals}
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
-@app.post("/api/import/manual", dependencies=[Depends(verify_password)])
-def run_manual_import(req: ManualImportRequest):
-    results = []
+def prepare_manual_import(client_doc_id):
+    """Charge la config Silae et la fiche client (mot de passe Odoo déchiffré)."""
     try:
-        token = get_silae_token_manual(get_silae_config())
-        client_ref = db.collection("payflow_clients").document(req.client_doc_id).get()
+        silae_conf = get_silae_config()
+        get_silae_token_manual(silae_conf)
+        client_ref = db.collection("payflow_clients").document(client_doc_id).get()
         if not client_ref.exists: raise HTTPException(status_code=404)
         client_data = client_ref.to_dict()
         
-        f = Fernet(get_encryption_key())
+        f = get_fernet()
         client_data['odoo_password'] = f.decrypt(client_data['odoo_password'].encode()).decode()
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    return client_data, silae_conf
 
-    for period in req.periods:
+def import_manual_period(client_doc_id, client_data, silae_conf, period, force=False):
+    """Importe une période et la journalise (MANUAL_*, avec durées par étape). Retourne {"period", "status", "message"}."""
+    trace = Trace(client_data.get('odoo_host'), observer=stage_metrics.observe)
+    with use_trace(trace):
         try:
             d = datetime.strptime(period, "%Y-%m")
             next_m = d.replace(year=d.year+1, month=1) if d.month == 12 else d.replace(month=d.month+1)
-            end = next_m - pd.Timedelta(days=1)
+            end = next_m - timedelta(days=1)
             
-            ecritures = get_silae_ecritures_manual(token, get_silae_config(), client_data['numero_dossier_silae'], d, end)
-            status, msg = import_to_odoo_logic(client_data, ecritures, period, end)
+            with memory_peak(f"{client_doc_id} {period}"), span("import"):
+                ecritures = fetch_silae_ecritures(get_silae_token_manual(silae_conf), silae_conf, client_data['numero_dossier_silae'], d, end)
+                status, msg = import_to_odoo_logic(client_data, ecritures, period, end, client_doc_id, force)
             
-            log_db(req.client_doc_id, client_data.get('nom'), period, f"MANUAL_{status}", msg)
-            results.append({"period": period, "status": "success" if "SUCCESS" in status else "error", "message": msg})
+            log_db(client_doc_id, client_data.get('nom'), period, f"MANUAL_{status}", msg, trace.as_dict())
+            return {"period": period, "status": "success" if "SUCCESS" in status else "error", "message": msg}
         except Exception as e:
-            log_db(req.client_doc_id, client_data.get('nom'), period, "MANUAL_CRASH", str(e))
-            results.append({"period": period, "status": "error", "message": str(e)})
+            log_db(client_doc_id, client_data.get('nom'), period, "MANUAL_CRASH", str(e), trace.as_dict())
+            return {"period": period, "status": "error", "message": str(e)}
+
+@app.post("/api/import/manual", dependencies=[Depends(verify_password)])
+def run_manual_import(req: ManualImportRequest):
+    client_data, silae_conf = prepare_manual_import(req.client_doc_id)
+    results = [import_manual_period(req.client_doc_id, client_data, silae_conf, period, req.force) for period in req.periods]
+    log_buffer.flush(retries=3)
     return {"results": results}
 
+@app.post("/api/import/manual/stream", dependencies=[Depends(verify_password)])
+def run_manual_import_stream(req: ManualImportRequest):
+    client_data, silae_conf = prepare_manual_import(req.client_doc_id)
+    return StreamingResponse(
+        stream_manual_import(req.client_doc_id, client_data, silae_conf, req.periods, req.force),
+        media_type="application/x-ndjson",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.post("/api/import/jobs", dependencies=[Depends(verify_password)])
+def submit_import_job(req: ManualImportRequest):
+    if not db: raise HTTPException(status_code=503, detail="Firestore indisponible")
+    client_data, silae_conf = prepare_manual_import(req.client_doc_id)
+    return {"job_id": start_import_job(req.client_doc_id, client_data, silae_conf, req.periods, req.force)}
+
+@app.get("/api/import/jobs/{job_id}", dependencies=[Depends(verify_password)])
+def get_import_job(job_id: str):
+    if not db: raise HTTPException(status_code=503, detail="Firestore indisponible")
+    snap = db.collection("payflow_jobs").document(job_id).get()
+    if not snap.exists: raise HTTPException(status_code=404)
+    job = snap.to_dict()
+    updated = job.get('updated_at')
+    if job.get('status') == "RUNNING" and updated:
+        # Instance du pool recyclée : plus de battement de cœur, le job ne se terminera jamais
+        age = datetime.now(timezone.utc) - (updated if updated.tzinfo else updated.replace(tzinfo=timezone.utc))
+        if age.total_seconds() > JOB_STALE_AFTER:
+            job['status'] = "STALE"
+            for p in job.get('periods', {}).values():
+                if p.get('status') in ("pending", "running"):
+                    p.update(status="error", message="Import interrompu (instance arrêtée), à relancer.")
+    for k in ('created_at', 'updated_at'):
+        if job.get(k): job[k] = job[k].isoformat()
+    return job
+
 # --- ASSETS ---
-app.mount("/assets", StaticFiles(directory="/app/static/assets"), name="assets")
+STATIC_DIR = os.environ.get("PAYFLOW_STATIC_DIR", "/app/static")
+STATIC_MEMORY_MAX = int(os.environ.get("PAYFLOW_STATIC_MEMORY_MAX", str(2 * 1024 * 1024)))
+COMPRESSIBLE = {".html", ".js", ".mjs", ".css", ".json", ".svg", ".txt", ".map", ".xml", ".webmanifest"}
+COMPRESS_MIN_SIZE = 1024
+# Noms de fichiers hachés par Vite : un contenu modifié change d'URL
+CACHE_IMMUTABLE = "public, max-age=31536000, immutable"
+CACHE_DEFAULT = "public, max-age=3600"
+
+def static_encoders(build=False):
+    """(encodage, suffixe, compression) par ordre de préférence. Au build, compression maximale."""
+    encoders = []
+    if brotli: encoders.append(("br", ".br", lambda b: brotli.compress(b, quality=11 if build else 5)))
+    encoders.append(("gzip", ".gz", lambda b: gzip.compress(b, 9 if build else 6, mtime=0)))
+    return encoders
+
+class StaticAsset:
+    """Fichier du build Vue. Contenu, ETag et variantes compressées sont chargés au premier accès."""
+
+    def __init__(self, path, stat, cache_control):
+        self.path = path
+        self.stat = stat
+        self.cache_control = cache_control
+        self.media_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+        self.compressible = os.path.splitext(path)[1] in COMPRESSIBLE and stat.st_size >= COMPRESS_MIN_SIZE
+        self.etag = None
+        self.body = None
+        self.variants = {}       # encodage -> octets (fichiers gardés en mémoire)
+        self.disk_variants = {}  # encodage -> (chemin, stat) (gros fichiers précompressés)
+        self._lock = threading.Lock()
+
+    def load(self):
+        if self.etag: return
+        with self._lock:
+            if self.etag: return
+            digest = hashlib.sha256()
+            if self.stat.st_size > STATIC_MEMORY_MAX:
+                # Gros fichier : servi depuis le disque, avec ses variantes précompressées s'il y en a
+                with open(self.path, "rb") as f:
+                    for chunk in iter(lambda: f.read(1024 * 1024), b""): digest.update(chunk)
+                for encoding, suffix, _ in static_encoders():
+                    if self.compressible and os.path.isfile(self.path + suffix):
+                        self.disk_variants[encoding] = (self.path + suffix, os.stat(self.path + suffix))
+            else:
+                with open(self.path, "rb") as f: self.body = f.read()
+                digest.update(self.body)
+                if self.compressible: self.variants = self._compress()
+            self.etag = digest.hexdigest()[:32]
+
+    def _compress(self):
+        variants = {}
+        for encoding, suffix, compress in static_encoders():
+            # Variante précompressée au build (cf. Dockerfile), sinon compressée ici une fois pour toutes
+            if os.path.isfile(self.path + suffix):
+                with open(self.path + suffix, "rb") as f: data = f.read()
+            else:
+                data = compress(self.body)
+            if len(data) < len(self.body): variants[encoding] = data
+        return variants
+
+def accepted_encodings(header):
+    accepted = set()
+    for part in (header or "").split(","):
+        token, _, params = part.strip().partition(";")
+        params = params.replace(" ", "")
+        try:
+            if params.startswith("q=") and float(params[2:]) == 0: continue
+        except ValueError:
+            continue
+        accepted.add(token.strip().lower())
+    return accepted
+
+def etag_matches(if_none_match, etag):
+    if not if_none_match: return False
+    if if_none_match.strip() == "*": return True
+    # Comparaison faible (RFC 9110) : W/"x" correspond à "x"
+    return etag in {t.strip().removeprefix("W/") for t in if_none_match.split(",")}
+
+class StaticSite:
+    """Index du build Vue, construit une fois au démarrage (parcours et stat, sans lecture).
+
+    index.html est gardé en mémoire et sert de repli aux routes du routeur Vue ; les fichiers
+    sous assets/ (noms hachés) sont servis avec un Cache-Control immuable.
+    """
+
+    def __init__(self, root=STATIC_DIR):
+        self.root = root
+        self.files = {}
+        for dirpath, _, names in os.walk(root):
+            for name in names:
+                path = os.path.join(dirpath, name)
+                if name.endswith((".br", ".gz")) and os.path.isfile(path[:-3]): continue
+                rel = os.path.relpath(path, root).replace(os.sep, "/")
+                cache = CACHE_IMMUTABLE if rel.startswith("assets/") else "no-cache" if rel == "index.html" else CACHE_DEFAULT
+                self.files[rel] = StaticAsset(path, os.stat(path), cache)
+        self.index = self.files.get("index.html")
+        if self.index: self.index.load()
+
+    def precompress(self):
+        """Écrit les variantes .br / .gz à côté des fichiers compressibles (étape de build)."""
+        count = 0
+        for asset in self.files.values():
+            if not asset.compressible: continue
+            with open(asset.path, "rb") as f: body = f.read()
+            for _, suffix, compress in static_encoders(build=True):
+                with open(asset.path + suffix, "wb") as f: f.write(compress(body))
+                count += 1
+        print(f"{count} variante(s) compressée(s) écrite(s) dans {self.root}")
+
+    def response(self, full_path, accept_encoding=None, if_none_match=None):
+        asset = self.files.get(full_path)
+        if asset is None:
+            # Fichier haché absent : 404 (comme l'ancien montage /assets), pas la page d'accueil
+            if full_path.startswith("assets/") or not self.index: raise HTTPException(status_code=404)
+            asset = self.index
+        asset.load()
+
+        accepted = accepted_encodings(accept_encoding)
+        available = asset.variants or asset.disk_variants
+        encoding = next((e for e, _, _ in static_encoders() if e in accepted and e in available), None)
+        # ETag fort propre à chaque représentation
+        etag = f'"{asset.etag}-{encoding}"' if encoding else f'"{asset.etag}"'
+        headers = {"ETag": etag, "Cache-Control": asset.cache_control}
+        if available: headers["Vary"] = "Accept-Encoding"
+        if etag_matches(if_none_match, etag): return Response(status_code=304, headers=headers)
+        if encoding: headers["Content-Encoding"] = encoding
+        if asset.body is None:
+            path, stat = asset.disk_variants[encoding] if encoding else (asset.path, asset.stat)
+            return FileResponse(path, media_type=asset.media_type, headers=headers, stat_result=stat)
+        return Response(asset.variants[encoding] if encoding else asset.body, media_type=asset.media_type, headers=headers)
+
+static_site = StaticSite()
+
+# Route synchrone (threadpool) : le premier accès à un fichier le lit, le hashe et le compresse
 @app.get("/{full_path:path}")
-async def serve_vue_app(full_path: str):
+def serve_vue_app(full_path: str, accept_encoding: Optional[str] = Header(None), if_none_match: Optional[str] = Header(None)):
     if full_path.startswith("api"): raise HTTPException(status_code=404)
-    file_path = f"/app/static/{full_path}"
-    if os.path.exists(file_path) and os.path.isfile(file_path): return FileResponse(file_path)
-    return FileResponse("/app/static/index.html")
\ No newline at end of file
+    return static_site.response(full_path, accept_encoding, if_none_match)
+
+startup_profile.loaded()
@@ -0,0 +1,320 @@
+"""Doublures locales pour les bancs d'essai : Silae (HTTP), Odoo (XML-RPC), Firestore et Secret Manager.
+
+Les serveurs Silae et Odoo écoutent en HTTPS sur 127.0.0.1 avec un certificat auto-signé
+(`make_certificate`) : le code de production les appelle sans modification, il suffit de
+faire pointer `PAYFLOW_SILAE_*_URL`, `odoo_host`, `SSL_CERT_FILE` et `REQUESTS_CA_BUNDLE` dessus.
+"""
+import copy
+import datetime
+import ipaddress
+import json
+import os
+import ssl
+import threading
+import time
+import xmlrpc.client
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from socketserver import ThreadingMixIn
+from xmlrpc.server import SimpleXMLRPCRequestHandler, SimpleXMLRPCServer
+
+# Comptes de paie usuels : les lignes générées tournent sur ce plan
+ACCOUNTS = ["421000", "431100", "431200", "437100", "437200", "437300", "442100", "447000",
+            "641100", "641200", "641300", "641400", "645100", "645200", "645300", "645400",
+            "645500", "647100", "647500", "648000"]
+
+def make_certificate(directory):
+    """Certificat auto-signé pour 127.0.0.1 / localhost. Retourne (cert.pem, key.pem)."""
+    from cryptography import x509
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import ec
+    from cryptography.x509.oid import NameOID
+
+    key = ec.generate_private_key(ec.SECP256R1())
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "payflow-bench")])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    cert = (x509.CertificateBuilder()
+            .subject_name(name).issuer_name(name).public_key(key.public_key())
+            .serial_number(x509.random_serial_number())
+            .not_valid_before(now - datetime.timedelta(minutes=5))
+            .not_valid_after(now + datetime.timedelta(days=1))
+            .add_extension(x509.SubjectAlternativeName([x509.DNSName("localhost"), x509.IPAddress(ipaddress.ip_address("127.0.0.1"))]), critical=False)
+            .add_extension(x509.BasicConstraints(ca=True, path_length=None), critical=True)
+            .sign(key, hashes.SHA256()))
+    cert_path, key_path = os.path.join(directory, "cert.pem"), os.path.join(directory, "key.pem")
+    with open(cert_path, "wb") as f:
+        f.write(cert.public_bytes(serialization.Encoding.PEM))
+    with open(key_path, "wb") as f:
+        f.write(key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()))
+    return cert_path, key_path
+
+def _tls(server, cert):
+    ctx = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    ctx.load_cert_chain(*cert)
+    server.socket = ctx.wrap_socket(server.socket, server_side=True)
+    return server
+
+class Counters:
+    def __init__(self):
+        self._counts = {}
+        self._lock = threading.Lock()
+
+    def add(self, key):
+        with self._lock:
+            self._counts[key] = self._counts.get(key, 0) + 1
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self._counts)
+
+    def reset(self):
+        with self._lock:
+            self._counts.clear()
+
+# --- SILAE ---
+def silae_payload(dossier, lines):
+    """Réponse EcrituresComptables4 équilibrée de `lines` lignes, réparties sur quelques ruptures."""
+    ruptures, current = [], []
+    for i in range(lines):
+        current.append({"compte": ACCOUNTS[i % len(ACCOUNTS)], "libelle": f"Dossier {dossier} ligne {i}",
+                        "valeur": round(100 + (i * 37) % 900 + 0.25, 2), "sens": "D" if i % 2 == 0 else "C"})
+        if len(current) == 50:
+            ruptures.append({"ecritures": current})
+            current = []
+    ruptures.append({"ecritures": current or None})
+    return {"ruptures": ruptures}
+
+class FakeSilae:
+    """API Silae : jeton OAuth2 et EcrituresComptables4 (`lines` lignes, `latency` s par appel)."""
+
+    def __init__(self, cert, lines=100, latency=0.0):
+        self.lines = lines
+        self.latency = latency
+        self.counters = Counters()
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+                if self.path.endswith("/oauth2/v2.0/token"):
+                    fake.counters.add("token")
+                    self._json({"access_token": "bench-token", "token_type": "Bearer", "expires_in": 3600})
+                elif self.path.endswith("/EcrituresComptables4"):
+                    fake.counters.add("ecritures")
+                    if fake.latency: time.sleep(fake.latency)
+                    dossier = json.loads(body or b"{}").get("numeroDossier")
+                    self._json(silae_payload(dossier, fake.lines))
+                else:
+                    self._json({"error": "not found"}, 404)
+
+            def _json(self, data, status=200):
+                raw = json.dumps(data).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(raw)))
+                self.end_headers()
+                self.wfile.write(raw)
+
+        self.server = _tls(ThreadingHTTPServer(("127.0.0.1", 0), Handler), cert)
+        self.server.daemon_threads = True
+
+    @property
+    def url(self):
+        return f"https://127.0.0.1:{self.server.server_address[1]}"
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+
+# --- ODOO ---
+class _ThreadingXMLRPCServer(ThreadingMixIn, SimpleXMLRPCServer):
+    daemon_threads = True
+
+class FakeOdoo:
+    """Odoo XML-RPC : authenticate, account.journal search, account.account search_read, account.move create.
+
+    `odoo18=True` refuse le domaine `company_id` sur account.account, comme Odoo 18.
+    """
+
+    def __init__(self, cert, odoo18=False, latency=0.0):
+        self.odoo18 = odoo18
+        self.latency = latency
+        self.counters = Counters()
+        self._move_id = 0
+        self._lock = threading.Lock()
+
+        class Handler(SimpleXMLRPCRequestHandler):
+            protocol_version = "HTTP/1.1"
+            rpc_paths = ("/xmlrpc/2/common", "/xmlrpc/2/object")
+
+        server = _ThreadingXMLRPCServer(("127.0.0.1", 0), requestHandler=Handler, logRequests=False, allow_none=True)
+        server.register_function(self.authenticate, "authenticate")
+        server.register_function(self.execute_kw, "execute_kw")
+        self.server = _tls(server, cert)
+
+    @property
+    def host(self):
+        return f"127.0.0.1:{self.server.server_address[1]}"
+
+    def authenticate(self, db, login, password, user_agent_env):
+        self.counters.add("authenticate")
+        return 2
+
+    def execute_kw(self, db, uid, password, model, method, args, kw=None):
+        self.counters.add(f"{model}.{method}")
+        if self.latency: time.sleep(self.latency)
+        if model == "account.journal" and method == "search":
+            return [7]
+        if model == "account.account" and method == "search_read":
+            domain = args[0]
+            if self.odoo18 and any(isinstance(t, list) and t[0] == "company_id" for t in domain):
+                raise xmlrpc.client.Fault(2, "Invalid field 'company_id' on model 'account.account'")
+            codes = next(t[2] for t in domain if isinstance(t, list) and t[0] == "code")
+            return [{"id": 1000 + ACCOUNTS.index(c), "code": c} for c in codes if c in ACCOUNTS]
+        if model == "account.move" and method == "create":
+            with self._lock:
+                self._move_id += 1
+                return self._move_id
+        raise xmlrpc.client.Fault(1, f"{model}.{method} non simulé")
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+
+# --- FIRESTORE (en mémoire) ---
+def _apply(target, data, merge):
+    for key, value in data.items():
+        kind = type(value).__name__
+        if kind == "Increment":
+            target[key] = (target.get(key) or 0) + value.value
+        elif kind == "ArrayUnion":
+            current = list(target.get(key) or [])
+            target[key] = current + [v for v in value.values if v not in current]
+        elif merge and isinstance(value, dict) and isinstance(target.get(key), dict):
+            _apply(target[key], value, merge)
+        else:
+            target[key] = copy.deepcopy(value) if isinstance(value, (dict, list)) else value
+
+def _field_path(key):
+    """`periods.\`2026-01\`` -> ["periods", "2026-01"] (chemins de champ de DocumentReference.update)."""
+    parts, current, quoted = [], "", False
+    for ch in key:
+        if ch == "`":
+            quoted = not quoted
+        elif ch == "." and not quoted:
+            parts.append(current)
+            current = ""
+        else:
+            current += ch
+    return parts + [current]
+
+class FakeSnapshot:
+    def __init__(self, doc_id, data):
+        self.id = doc_id
+        self._data = data
+
+    @property
+    def exists(self):
+        return self._data is not None
+
+    def to_dict(self):
+        return copy.deepcopy(self._data)
+
+class FakeDocument:
+    def __init__(self, store, collection, doc_id):
+        self._store, self._collection, self.id = store, collection, doc_id
+
+    def _docs(self):
+        return self._store.data.setdefault(self._collection, {})
+
+    def get(self, transaction=None):
+        with self._store.lock:
+            return FakeSnapshot(self.id, copy.deepcopy(self._docs().get(self.id)))
+
+    def set(self, data, merge=False):
+        with self._store.lock:
+            docs = self._docs()
+            target = docs.get(self.id) if merge and self.id in docs else {}
+            _apply(target, data, merge)
+            docs[self.id] = target
+
+    def update(self, data):
+        with self._store.lock:
+            if self.id not in self._docs(): raise KeyError(f"{self._collection}/{self.id}")
+            for key, value in data.items():
+                *parents, field = _field_path(key)
+                target = self._docs()[self.id]
+                for name in parents:
+                    target = target.setdefault(name, {})
+                _apply(target, {field: value}, False)
+
+    def delete(self):
+        with self._store.lock:
+            self._docs().pop(self.id, None)
+
+class FakeQuery:
+    def __init__(self, store, collection, filters=()):
+        self._store, self._collection, self._filters = store, collection, filters
+
+    def where(self, field, op, value):
+        if op != "==": raise NotImplementedError(op)
+        return FakeQuery(self._store, self._collection, self._filters + ((field, value),))
+
+    def document(self, doc_id):
+        return FakeDocument(self._store, self._collection, doc_id)
+
+    def stream(self):
+        with self._store.lock:
+            docs = list(self._store.data.get(self._collection, {}).items())
+        return [FakeSnapshot(k, copy.deepcopy(v)) for k, v in docs if all(v.get(f) == val for f, val in self._filters)]
+
+class FakeBatch:
+    def __init__(self, store):
+        self._store, self._ops = store, []
+
+    def set(self, ref, data, merge=False):
+        self._ops.append((ref, data, merge))
+
+    def commit(self):
+        self._store.counters.add("batch_commit")
+        for ref, data, merge in self._ops: ref.set(data, merge=merge)
+
+class FakeFirestore:
+    """Sous-ensemble de google.cloud.firestore.Client utilisé par PayFlow (sans transactions)."""
+
+    def __init__(self):
+        self.data = {}
+        self.lock = threading.RLock()
+        self.counters = Counters()
+
+    def collection(self, name):
+        return FakeQuery(self, name)
+
+    def batch(self):
+        return FakeBatch(self)
+
+# --- SECRET MANAGER ---
+class _Payload:
+    def __init__(self, value):
+        self.payload = type("Payload", (), {"data": value.encode("utf-8")})()
+
+class FakeSecretManager:
+    def __init__(self, secrets):
+        self.secrets = secrets
+
+    def access_secret_version(self, request):
+        name = request["name"].split("/secrets/")[1].split("/")[0]
+        if name not in self.secrets:
+            from google.api_core.exceptions import NotFound
+            raise NotFound(name)
+        return _Payload(self.secrets[name])
@@ -0,0 +1,221 @@
+"""Bancs d'essai hors ligne : import manuel (Backend) et Robot mensuel contre Silae / Odoo simulés.
+
+    python benchmarks/run.py                      # tous les scénarios, comparés à baseline.json
+    python benchmarks/run.py --only robot-50      # scénarios dont le nom contient "robot-50"
+    python benchmarks/run.py --env PAYFLOW_ROBOT_PIPELINE=1 --env PAYFLOW_SILAE_STREAMING=1
+    python benchmarks/run.py --save-baseline      # enregistre les résultats comme nouvelle référence
+
+Chaque scénario tourne dans un processus neuf (caches froids, mémoire propre) : des passes
+chronométrées (médiane), puis une passe sous tracemalloc pour le pic mémoire. Les appels
+réseau sont comptés côté serveurs simulés. Les résultats vont dans benchmarks/results/<date>.json.
+"""
+import argparse
+import collections
+import contextlib
+import importlib.util
+import io
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+sys.path.insert(0, HERE)
+
+from fakes import FakeFirestore, FakeOdoo, FakeSecretManager, FakeSilae, make_certificate
+
+BASELINE = os.path.join(HERE, "baseline.json")
+RESULTS_DIR = os.path.join(HERE, "results")
+
+SCENARIOS = [
+    {"name": "manual-10", "kind": "backend", "clients": 1, "lines": 10},
+    {"name": "manual-100", "kind": "backend", "clients": 1, "lines": 100},
+    {"name": "manual-1000", "kind": "backend", "clients": 1, "lines": 1000},
+    {"name": "manual-100-odoo18", "kind": "backend", "clients": 1, "lines": 100, "odoo18": True},
+    {"name": "robot-1", "kind": "automation", "clients": 1, "lines": 100},
+    {"name": "robot-50", "kind": "automation", "clients": 50, "lines": 100},
+    {"name": "robot-500", "kind": "automation", "clients": 500, "lines": 100},
+    {"name": "robot-50-odoo18", "kind": "automation", "clients": 50, "lines": 100, "odoo18": True},
+]
+MANUAL_PERIODS = ["2026-01", "2026-02", "2026-03"]
+
+# --- PROCESSUS DE MESURE (un par scénario et par passe) ---
+def load_app(kind):
+    """Charge backend/main.py ou automation/main.py sous un nom distinct (les deux s'appellent main)."""
+    path = os.path.join(ROOT, kind, "main.py")
+    sys.path.insert(0, os.path.dirname(path))
+    spec = importlib.util.spec_from_file_location(f"payflow_{kind}", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def seed_clients(fs, spec, fernet):
+    day = datetime.utcnow().day
+    password = fernet.encrypt(b"bench-password").decode()
+    for i in range(spec["clients"]):
+        fs.collection("payflow_clients").document(f"c{i:04d}").set({
+            "nom": f"Client {i:04d}", "numero_dossier_silae": str(10000 + i), "jour_transfert": day,
+            "odoo_host": spec["odoo_hosts"][i % len(spec["odoo_hosts"])], "database_odoo": f"client{i:04d}",
+            "odoo_login": f"paie{i:04d}@bench.local", "odoo_password": password,
+            "journal_paie_odoo": "PAIE", "odoo_company_id": 1,
+        })
+
+def run_child(spec, out_path, memory):
+    from cryptography.fernet import Fernet
+
+    key = Fernet.generate_key().decode()
+    secrets = {"PAYFLOW_ENCRYPTION_KEY": key, "PAYFLOW_PASSWORD": "bench",
+               "SILAE_CLIENT_ID": "bench", "SILAE_CLIENT_SECRET": "bench", "SILAE_SUBSCRIPTION_KEY": "bench"}
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        app = load_app(spec["kind"])
+    import_s = time.perf_counter() - started
+    # Modules que l'application importe au premier usage : chargés ici, hors mesure de l'import
+    import google.api_core.exceptions, google.cloud.firestore  # noqa: E401
+
+    fs = FakeFirestore()
+    seed_clients(fs, spec, Fernet(key))
+    app.log_buffer.client = fs
+    if spec["kind"] == "backend":
+        app.db, app.secret_client = fs, FakeSecretManager(secrets)
+        run = lambda: app.run_manual_import(app.ManualImportRequest(client_doc_id="c0000", periods=MANUAL_PERIODS))
+    else:
+        app.DB, app.SECRET_CLIENT = fs, FakeSecretManager(secrets)
+        run = lambda: app.process_monthly_import({"attributes": {}}, None)
+
+    output = io.StringIO()
+    if memory: tracemalloc.start()
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(output):
+        run()
+    wall_s = time.perf_counter() - started
+    peak = tracemalloc.get_traced_memory()[1] if memory else None
+    if memory: tracemalloc.stop()
+
+    statuses = collections.Counter(log["status"] for log in fs.data.get("payflow_logs", {}).values())
+    with open(out_path, "w") as f:
+        json.dump({"import_s": import_s, "wall_s": wall_s, "peak_bytes": peak, "statuses": statuses,
+                   "firestore_batches": fs.counters.snapshot().get("batch_commit", 0), "output": output.getvalue()[-4000:]}, f)
+
+# --- ORCHESTRATION ---
+def measure(spec, env, memory, verbose):
+    with tempfile.NamedTemporaryFile(suffix=".json", delete=False) as tmp:
+        out_path = tmp.name
+    try:
+        cmd = [sys.executable, os.path.abspath(__file__), "--child", json.dumps(spec), out_path] + (["--memory"] if memory else [])
+        proc = subprocess.run(cmd, env=env, capture_output=not verbose, text=True)
+        if proc.returncode != 0:
+            raise RuntimeError(f"{spec['name']} a échoué :\n{proc.stderr if not verbose else ''}")
+        with open(out_path) as f:
+            return json.load(f)
+    finally:
+        os.remove(out_path)
+
+def run_all(args):
+    workdir = tempfile.mkdtemp(prefix="payflow-bench-")
+    cert = make_certificate(workdir)
+    silae = FakeSilae(cert, latency=args.silae_latency / 1000).start()
+    odoo = {flag: [FakeOdoo(cert, odoo18=flag, latency=args.odoo_latency / 1000).start() for _ in range(args.odoo_hosts)]
+            for flag in (False, True)}
+    extra_env = dict(kv.split("=", 1) for kv in args.env)
+    env = dict(os.environ, GCP_PROJECT="payflow-bench", SSL_CERT_FILE=cert[0], REQUESTS_CA_BUNDLE=cert[0],
+               PAYFLOW_SILAE_AUTH_URL=f"{silae.url}/oauth2/v2.0/token", PAYFLOW_SILAE_API_URL=silae.url,
+               PAYFLOW_TRACE_MEMORY="0", PYTHONUNBUFFERED="1", **extra_env)
+
+    scenarios = [s for s in SCENARIOS if not args.only or any(o in s["name"] for o in args.only)]
+    results = {}
+    for scenario in scenarios:
+        servers = odoo[bool(scenario.get("odoo18"))]
+        spec = dict(scenario, odoo_hosts=[s.host for s in servers])
+        silae.lines = scenario["lines"]
+        # Durée : médiane de `repeat` passes ; les compteurs d'appels sont ceux de la dernière
+        walls = []
+        for _ in range(args.repeat):
+            for s in [silae, *servers]: s.counters.reset()
+            timing = measure(spec, env, memory=False, verbose=args.verbose)
+            walls.append(timing["wall_s"])
+        rpc = {f"silae.{k}": v for k, v in silae.counters.snapshot().items()}
+        for server in servers:
+            for k, v in server.counters.snapshot().items(): rpc[f"odoo.{k}"] = rpc.get(f"odoo.{k}", 0) + v
+        peak = None if args.no_memory else measure(spec, env, memory=True, verbose=args.verbose)["peak_bytes"]
+
+        results[scenario["name"]] = {
+            "clients": scenario["clients"], "lines": scenario["lines"], "odoo18": bool(scenario.get("odoo18")),
+            "wall_s": round(statistics.median(walls), 3), "import_s": round(timing["import_s"], 3),
+            "rpc": sum(rpc.values()), "rpc_detail": dict(sorted(rpc.items())),
+            "peak_mb": round(peak / 1024 / 1024, 2) if peak is not None else None,
+            "firestore_batches": timing["firestore_batches"], "statuses": timing["statuses"],
+        }
+        r = results[scenario["name"]]
+        print(f"{scenario['name']:<20} {r['wall_s']:>8.2f}s  {r['rpc']:>6} rpc  "
+              f"{r['peak_mb'] if r['peak_mb'] is not None else '-':>7} Mo  {dict(r['statuses'])}")
+    return {"date": datetime.utcnow().isoformat(timespec="seconds"), "python": sys.version.split()[0],
+            "silae_latency_ms": args.silae_latency, "odoo_latency_ms": args.odoo_latency,
+            "odoo_hosts": args.odoo_hosts, "repeat": args.repeat, "env": extra_env, "scenarios": results}
+
+def compare(current, baseline, tolerance):
+    """Écarts par rapport à la référence. Retourne la liste des régressions."""
+    regressions = []
+    print(f"\n{'scénario':<20} {'durée':>18} {'rpc':>14} {'mémoire':>18}")
+    for name, cur in current["scenarios"].items():
+        base = baseline["scenarios"].get(name)
+        if not base: continue
+        wall = (cur["wall_s"] - base["wall_s"]) / base["wall_s"] * 100 if base["wall_s"] else 0.0
+        mem = (cur["peak_mb"] - base["peak_mb"]) / base["peak_mb"] * 100 if cur["peak_mb"] and base.get("peak_mb") else None
+        memory = f"{cur['peak_mb']:>7.2f} Mo ({mem:+6.1f}%)" if mem is not None else f"{'-':>18}"
+        print(f"{name:<20} {cur['wall_s']:>8.2f}s ({wall:+6.1f}%) {cur['rpc']:>6} ({cur['rpc'] - base['rpc']:+5d}) {memory}")
+        # Le nombre d'appels est déterministe : toute hausse est une régression
+        if cur["rpc"] > base["rpc"]: regressions.append(f"{name}: {cur['rpc']} rpc (référence {base['rpc']})")
+        if wall > tolerance * 100 and cur["wall_s"] - base["wall_s"] > 0.05:
+            regressions.append(f"{name}: durée {cur['wall_s']:.2f}s (référence {base['wall_s']:.2f}s)")
+        if mem is not None and mem > tolerance * 100:
+            regressions.append(f"{name}: mémoire {cur['peak_mb']:.2f} Mo (référence {base['peak_mb']:.2f} Mo)")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--only", action="append", default=[], help="filtre sur le nom de scénario (répétable)")
+    parser.add_argument("--env", action="append", default=[], help="variable KEY=VALUE passée à l'application (répétable)")
+    parser.add_argument("--silae-latency", type=float, default=20, help="latence simulée par appel Silae (ms)")
+    parser.add_argument("--odoo-latency", type=float, default=5, help="latence simulée par appel Odoo (ms)")
+    parser.add_argument("--odoo-hosts", type=int, default=8, help="serveurs Odoo simulés entre lesquels les clients sont répartis")
+    parser.add_argument("--repeat", type=int, default=3, help="passes chronométrées par scénario (médiane)")
+    parser.add_argument("--no-memory", action="store_true", help="sans la passe tracemalloc")
+    parser.add_argument("--baseline", default=BASELINE)
+    parser.add_argument("--tolerance", type=float, default=0.25, help="écart relatif toléré sur durée et mémoire")
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--check", action="store_true", help="code de sortie 1 en cas de régression")
+    parser.add_argument("--verbose", action="store_true")
+    parser.add_argument("--child", nargs=2, metavar=("SPEC", "OUT"), help=argparse.SUPPRESS)
+    parser.add_argument("--memory", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        return run_child(json.loads(args.child[0]), args.child[1], args.memory)
+
+    current = run_all(args)
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    path = os.path.join(RESULTS_DIR, f"{datetime.utcnow().strftime('%Y%m%d-%H%M%S')}.json")
+    with open(path, "w") as f:
+        json.dump(current, f, indent=2)
+    print(f"\nRésultats : {os.path.relpath(path, ROOT)}")
+
+    regressions = []
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline) as f:
+            regressions = compare(current, json.load(f), args.tolerance)
+        for r in regressions: print(f"  ✗ régression {r}")
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(current, f, indent=2)
+        print(f"Référence mise à jour : {os.path.relpath(args.baseline, ROOT)}")
+    if args.check and regressions: sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""Démarrage à froid : temps d'import par module et délai avant la première réponse HTTP.
+
+    python benchmarks/startup.py                  # arbre courant
+    python benchmarks/startup.py --tree /tmp/old  # autre arbre (ex. `git worktree add /tmp/old HEAD~1`)
+
+Chaque mesure se fait dans un processus neuf. Pour le Backend, uvicorn est lancé comme sur
+Cloud Run et on mesure le délai jusqu'à la première réponse ; pour le Robot, le temps d'import
+de main.py (ce que paie chaque réveil de la Cloud Function avant `process_monthly_import`).
+"""
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.request
+from datetime import datetime
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+RESULTS_DIR = os.path.join(HERE, "results")
+
+def import_profile(app_dir, env, top=12):
+    """Import de main.py sous `-X importtime`. Retourne (total s, [(module, cumul s)] des plus lents)."""
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", "import main"], cwd=app_dir, env=env,
+                          capture_output=True, text=True)
+    modules, total = {}, None
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line: continue
+        own, cumulative, name = line[len("import time:"):].split("|")
+        cumulative = cumulative.strip()
+        if not cumulative.isdigit(): continue
+        # Colonne du nom : un espace, puis deux espaces par niveau d'imbrication
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        name = name.strip()
+        # Modules importés directement par main.py (profondeur 1), plus main lui-même
+        if name == "main":
+            total = int(cumulative) / 1e6
+            # Temps propre de main.py : exécution du module (clients créés à l'import, etc.)
+            modules["main.py (corps du module)"] = int(own) / 1e6
+        elif depth == 1:
+            modules[name] = max(modules.get(name, 0), int(cumulative) / 1e6)
+    return total, sorted(modules.items(), key=lambda kv: -kv[1])[:top]
+
+def import_time(app_dir, env):
+    code = "import time; t = time.perf_counter(); import main; print(time.perf_counter() - t)"
+    proc = subprocess.run([sys.executable, "-c", code], cwd=app_dir, env=env, capture_output=True, text=True)
+    return float(proc.stdout.strip().splitlines()[-1])
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def first_response(app_dir, env, path="/", timeout=60):
+    """Lance uvicorn et attend la première réponse HTTP (quel que soit son code)."""
+    port = _free_port()
+    started = time.perf_counter()
+    proc = subprocess.Popen([sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port)],
+                            cwd=app_dir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        while time.perf_counter() - started < timeout:
+            try:
+                urllib.request.urlopen(f"http://127.0.0.1:{port}{path}", timeout=1)
+                return time.perf_counter() - started
+            except urllib.error.HTTPError:
+                return time.perf_counter() - started
+            except OSError:
+                time.sleep(0.01)
+        raise RuntimeError("uvicorn n'a pas répondu")
+    finally:
+        proc.terminate()
+        proc.wait()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tree", default=ROOT, help="racine de l'arbre PayFlow à mesurer")
+    parser.add_argument("--runs", type=int, default=5, help="mesures par indicateur (médiane)")
+    args = parser.parse_args()
+
+    env = dict(os.environ, PYTHONDONTWRITEBYTECODE="1")
+    result = {"date": datetime.utcnow().isoformat(timespec="seconds"), "tree": os.path.abspath(args.tree),
+              "python": sys.version.split()[0], "runs": args.runs}
+    for kind in ("backend", "automation"):
+        app_dir = os.path.join(args.tree, kind)
+        import_profile(app_dir, env)  # premier passage : compilation .pyc des dépendances
+        imports = [import_time(app_dir, env) for _ in range(args.runs)]
+        total, modules = import_profile(app_dir, env)
+        entry = {"import_s": round(statistics.median(imports), 3),
+                 "modules_s": {name: round(s, 3) for name, s in modules}}
+        if kind == "backend":
+            entry["first_response_s"] = round(statistics.median(first_response(app_dir, env) for _ in range(args.runs)), 3)
+        result[kind] = entry
+
+        print(f"\n{kind} : import {entry['import_s']:.2f}s"
+              + (f", première réponse {entry['first_response_s']:.2f}s" if "first_response_s" in entry else ""))
+        for name, s in modules:
+            print(f"  {s * 1000:>8.0f} ms  {name}")
+
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    path = os.path.join(RESULTS_DIR, f"startup-{datetime.utcnow().strftime('%Y%m%d-%H%M%S')}.json")
+    with open(path, "w") as f:
+        json.dump(result, f, indent=2)
+    print(f"\nRésultats : {path}")
+
+if __name__ == "__main__":
+    main()
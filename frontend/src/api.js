@@ -31,4 +31,36 @@ api.interceptors.response.use(response => response, error => {
   return Promise.reject(error);
 });
 
+// Requête POST dont la réponse est lue au fil de l'eau (NDJSON : un objet JSON par ligne).
+// axios ne sait pas lire un flux dans le navigateur, on passe donc par fetch.
+export const postStream = async (url, payload, onItem) => {
+  const headers = { 'Content-Type': 'application/json' };
+  const pwd = localStorage.getItem('payflow-password');
+  if (pwd) headers['x-app-password'] = pwd;
+
+  const res = await fetch(url, { method: 'POST', headers, body: JSON.stringify(payload) });
+  if (res.status === 401) {
+    localStorage.removeItem('payflow-password');
+    router.push('/login');
+  }
+  if (!res.ok) {
+    const body = await res.json().catch(() => ({}));
+    throw new Error(body.detail || `HTTP ${res.status}`);
+  }
+
+  const reader = res.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = '';
+  while (true) {
+    const { done, value } = await reader.read();
+    buffer += decoder.decode(value || new Uint8Array(), { stream: !done });
+    const lines = buffer.split('\n');
+    buffer = lines.pop();
+    // Les lignes vides sont des battements de cœur du serveur
+    lines.filter(line => line.trim()).forEach(line => onItem(JSON.parse(line)));
+    if (done) break;
+  }
+  if (buffer.trim()) onItem(JSON.parse(buffer));
+};
+
 export default api;
\ No newline at end of file